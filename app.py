@@ -1,39 +1,244 @@
-from flask import Flask, request, render_template,jsonify, redirect, url_for, flash, session
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import linear_kernel
-import pandas as pd
-from gtts import gTTS
+from flask import Flask, request, render_template,jsonify, redirect, url_for, flash, session, Response, send_file, send_from_directory
+import atexit
+import hashlib
+import json
+import mimetypes
 import os
+import threading
+import time
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import delete, select
+
+import recipe_index
+import recommender
+import query_cache
+import audio
+import likes
+import collaborative
+import filters
+import suggest
+import metrics
+import scoring
+import user_profiles
+import static_assets
+from catalogue import Catalogue, NoIndexError
 
 app = Flask(__name__)
 
 
-# Read data from CSV file into a DataFrame
-recipe_df = pd.read_csv('recipes1.csv')
+# Load the recipes and their prebuilt, memory-mapped TF-IDF index (python recipe_index.py
+# build), plus any recipes ingested since. Requests read catalogue.snapshot once and
+# keep using it, so ingestion and compaction can swap in a new one at any time.
+# Nothing is loaded at import: see load_recommender() and start_background_tasks().
+app.config['RECIPES_CSV'] = os.environ.get('RECIPES_CSV', recipe_index.DEFAULT_CSV)
+app.config['RECIPE_INDEX_DIR'] = os.environ.get('RECIPE_INDEX_DIR', recipe_index.DEFAULT_INDEX_DIR)
+catalogue = Catalogue(app.config['RECIPES_CSV'], app.config['RECIPE_INDEX_DIR'])
 
-# Create a TfidfVectorizer to convert ingredients to a TF-IDF representation
-vectorizer = TfidfVectorizer()
-ingredients_matrix = vectorizer.fit_transform(recipe_df['ingredients'].apply(lambda x: ', '.join(x.split(', '))))
-
-def recommend_recipe(available_ingredients, recipe, vectorizer):
-    # Convert available ingredients to a TF-IDF representation
-    input_vector = vectorizer.transform([' '.join(available_ingredients)])
-
-    # Calculate cosine similarity between input and all recipes
-    cosine_similarities = linear_kernel(input_vector, ingredients_matrix).flatten()
-
-    # Get the index of the most similar recipe
-    recommended_index = cosine_similarities.argmax()
-
-    # Get the recommended recipe
-    recommended_recipe = recipe.iloc[recommended_index]
-
-    return recommended_recipe
+# Scoring engine: 'sparse' ranks by exact TF-IDF cosine over the postings, 'dense'
+# by cosine between LSA embeddings (embeddings.py), which also matches related
+# ingredients. 'dense' needs `python embeddings.py build` and falls back to
+# 'sparse' for an index without embeddings.
+app.config['RECOMMENDATION_ENGINE'] = os.environ.get('RECOMMENDATION_ENGINE', 'sparse')
 
+def dense_index(snapshot, engine=None):
+    # The snapshot's embeddings if the engine is dense and they exist, otherwise None
+    if (engine or app.config['RECOMMENDATION_ENGINE']) == 'dense':
+        return snapshot.dense
+    return None
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'mysql://root:@localhost/recipe'
+def rank_recipes(available_ingredients, snapshot, k=1, offset=0, user_id=None, allowed=None, engine=None):
+    # Convert available ingredients to a TF-IDF representation
+    with metrics.span('transform'):
+        input_vector = snapshot.vectorizer.transform([' '.join(available_ingredients)])
+
+    # Lean the query toward the ingredients of what the user liked before
+    if user_id is not None:
+        with metrics.span('user_profile'):
+            input_vector = user_profiles.blend(input_vector, get_user_profile(user_id, snapshot),
+                                          app.config['USER_PROFILE_WEIGHT'], app.config['USER_PROFILE_QUERY_TERMS'])
+
+    # Calculate cosine similarity against the recipes sharing at least one ingredient,
+    # or against every recipe's embedding
+    with metrics.span('score'):
+        dense = dense_index(snapshot, engine)
+        if dense is not None:
+            candidate_ids, scores = dense.candidates(input_vector)
+        else:
+            candidate_ids, scores = score_query(snapshot, input_vector)
+
+    # Blend in what users with similar likes also liked
+    if user_id is not None:
+        with metrics.span('blend'):
+            candidate_ids, scores = collaborative.blend(candidate_ids, scores, collab_model.score_for_user(user_id),
+                                                        len(snapshot), app.config['HYBRID_ALPHA'])
+
+    # Select the k most similar recipes (after skipping offset) without a full sort
+    # Recipes failing the filters in allowed are dropped before selection
+    with metrics.span('select'):
+        return recommender.top_k_candidates(candidate_ids, scores, len(snapshot), k, offset, allowed)
+
+def score_query(snapshot, input_vector):
+    # Candidate ids and scores of one query, batched with other requests' queries
+    # in the scoring pool when there is one
+    if scoring_batcher is not None:
+        try:
+            return scoring_batcher.submit(snapshot, input_vector).result()
+        except Exception:
+            app.logger.exception('Scoring pool failed, scoring in-process')
+    cosine_similarities = snapshot.score(input_vector)
+    return cosine_similarities.indices, cosine_similarities.data
+
+def score_queries(snapshot, input_vectors):
+    # Scores of a block of queries, in the scoring pool when there is one
+    if scoring_pool is not None:
+        try:
+            return scoring_pool.score(snapshot, input_vectors).result()
+        except Exception:
+            app.logger.exception('Scoring pool failed, scoring in-process')
+    return snapshot.score(input_vectors)
+
+def is_personalized(user_id):
+    return user_id is not None and collab_model.liked_by(user_id)
+
+def recommend_recipe(available_ingredients, snapshot, k=1, offset=0, user_id=None, filter_args=None, engine=None):
+    available_ingredients = query_cache.normalize_ingredients(available_ingredients)
+    filter_args = filter_args or {}
+    with metrics.span('filters'):
+        allowed = filters.build_mask(snapshot, **filter_args)
+
+    if is_personalized(user_id):
+        # Personalized rankings change with every like, so they bypass the shared cache
+        recommended_indices, scores = rank_recipes(available_ingredients, snapshot, k, offset, user_id, allowed, engine)
+        ranked = (recommended_indices.tolist(), scores.tolist())
+    else:
+        # The index version is part of the key so a rebuilt index never serves old results
+        engine = engine or app.config['RECOMMENDATION_ENGINE']
+        key = query_cache.make_key(snapshot.version, engine, available_ingredients, k, offset, filter_args)
+        with metrics.span('cache'):
+            ranked = recommendation_cache.get(key)
+        if ranked is None:
+            # Identical queries arriving together (a promoted ingredient, say) wait
+            # for one computation instead of each scoring the catalogue
+            def compute():
+                recommended_indices, scores = rank_recipes(available_ingredients, snapshot, k, offset, allowed=allowed,
+                                                           engine=engine)
+                ranked = (recommended_indices.tolist(), scores.tolist())
+                recommendation_cache.set(key, ranked)
+                return ranked
+            ranked = recommendation_flight.do(key, compute)
+    recommended_indices, scores = ranked
+
+    # Row views of the recommended recipes along with their id and score
+    recommended_recipes = []
+    for recipe_id, score in zip(recommended_indices, scores):
+        recipe = snapshot.recipes[recipe_id]
+        recipe.score = score
+        recommended_recipes.append(recipe)
+
+    return recommended_recipes
+
+
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'mysql://root:@localhost/recipe')
 app.config['SECRET_KEY'] = 'your_secret_key'
+app.config['DASHBOARD_PAGE_SIZE'] = 20
+
+# Text-to-speech runs on a background pool. TTS_ENGINE is any callable(text, path)
+# that writes an mp3; it is looked up for every job, so it can be swapped at any time.
+app.config['AUDIO_CACHE_DIR'] = os.environ.get('AUDIO_CACHE_DIR', 'audio_cache')
+app.config['AUDIO_CACHE_MAX_BYTES'] = 256 * 1024 * 1024
+app.config['TTS_ENGINE'] = audio.gtts_engine
+
+def synthesize_speech(text, path):
+    app.config['TTS_ENGINE'](text, path)
+
+audio_cache = audio.AudioCache(app.config['AUDIO_CACHE_DIR'], engine=metrics.timed('tts', synthesize_speech),
+                               max_bytes=app.config['AUDIO_CACHE_MAX_BYTES'])
+
+# Results of recommend_recipe, keyed by the normalized query. Point
+# RECOMMENDATION_CACHE_PATH at a SQLite file to share the cache between workers.
+app.config['RECOMMENDATION_CACHE_PATH'] = os.environ.get('RECOMMENDATION_CACHE_PATH')
+app.config['RECOMMENDATION_CACHE_SIZE'] = 4096
+app.config['RECOMMENDATION_CACHE_TTL'] = 600
+recommendation_cache = query_cache.create_cache(app.config['RECOMMENDATION_CACHE_PATH'],
+                                                maxsize=app.config['RECOMMENDATION_CACHE_SIZE'],
+                                                ttl=app.config['RECOMMENDATION_CACHE_TTL'])
+catalogue.on_swap.append(lambda snapshot: recommendation_cache.clear())
+recommendation_flight = query_cache.SingleFlight()
+
+# HTTP caching for the CDN in front. `python static_assets.py build` copies the
+# static files to ASSET_BUILD_DIR under content-hashed names, with gzip/brotli
+# variants; templates link them through asset_url() and they are served from
+# /assets/ to be cached for good. Without a build, pages link /static/ as before.
+app.config['ASSET_BUILD_DIR'] = os.environ.get('ASSET_BUILD_DIR', os.path.join(app.static_folder, 'dist'))
+app.config['ASSET_MAX_AGE'] = 365 * 24 * 3600
+app.config['PAGE_MAX_AGE'] = 300
+asset_manifest = static_assets.load_manifest(app.config['ASSET_BUILD_DIR'])
+
+def site_version():
+    # Changes whenever a template or an asset does, so a deploy invalidates every page ETag
+    digest = hashlib.sha256(json.dumps(asset_manifest, sort_keys=True).encode('utf-8'))
+    template_dir = os.path.join(app.root_path, app.template_folder)
+    for name in sorted(os.listdir(template_dir)):
+        with open(os.path.join(template_dir, name), 'rb') as f:
+            digest.update(name.encode('utf-8') + f.read())
+    return digest.hexdigest()[:16]
+
+app.config['SITE_VERSION'] = site_version()
+
+@app.template_global()
+def asset_url(path):
+    hashed = asset_manifest.get(path)
+    if hashed is None:
+        return url_for('static', filename=path)
+    return url_for('hashed_asset', filename=hashed)
+
+# Pages without per-request content, rendered once per process
+rendered_pages = {}
+
+def render_page(template):
+    page = rendered_pages.get(template)
+    if page is None or app.debug:
+        body = render_template(template)
+        page = rendered_pages[template] = (body, query_cache.make_etag(app.config['SITE_VERSION'], body))
+    response = app.make_response(page[0])
+    response.set_etag(page[1])
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['PAGE_MAX_AGE']
+    return response.make_conditional(request)
+
+def not_modified(etag):
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+# Ingredient autocomplete over the index vocabulary, rebuilt when compaction refits it
+app.config['SUGGEST_LIMIT'] = 10
+app.config['SUGGEST_MAX_LIMIT'] = 50
+ingredient_suggester = None
+
+def refresh_suggester(snapshot):
+    global ingredient_suggester
+    if ingredient_suggester is None or snapshot.index.version != ingredient_suggester.version:
+        ingredient_suggester = suggest.IngredientSuggester.from_index(snapshot.index)
+    return ingredient_suggester
+
+catalogue.on_swap.append(refresh_suggester)
+
+# Score queries in SCORING_PROCESSES spawned processes instead of on the request
+# threads (0 scores in-thread). Queries that arrive while the pool is busy are
+# batched into one sparse product. Started per process by start_background_tasks().
+app.config['SCORING_PROCESSES'] = int(os.environ.get('SCORING_PROCESSES', 0))
+app.config['SCORING_MAX_BATCH'] = 64
+scoring_pool = None
+scoring_batcher = None
+
+# Pick up recipes ingested or compacted by other workers
+app.config['CATALOGUE_REFRESH_INTERVAL'] = 5.0
+
+# Shared secret for POST /api/recipes; ingestion is disabled while unset
+app.config['INGEST_API_KEY'] = os.environ.get('INGEST_API_KEY')
 db = SQLAlchemy(app)
 
 class SignUp(db.Model):
@@ -47,16 +252,257 @@ class SignUp(db.Model):
 class LikedRecipe(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('sign_up.id'), nullable=False)
-    recipe_id = db.Column(db.Integer, db.ForeignKey('recipe.id'), nullable=False)
+    # Recipes live in the catalogue, not the database: recipe_id is a catalogue
+    # row id, resolved in bulk with catalogue.snapshot.lookup()
+    recipe_id = db.Column(db.Integer, nullable=False)
     created_at = db.Column(db.DateTime, nullable=False)
 
-    # Define a relationship to the Recipe model
-    recipe = db.relationship('Recipe', backref='liked_recipes', lazy=True)
+    # The dashboard pages through a user's likes newest first; a user likes a recipe at most once
+    __table_args__ = (db.Index('ix_liked_recipe_user_created', 'user_id', 'created_at'),
+                      db.UniqueConstraint('user_id', 'recipe_id', name='uq_liked_recipe_user_recipe'))
+
+class UserProfile(db.Model):
+    # Running taste profile of a user (see user_profiles.py), stored sparse: the term ids
+    # and weights as int32 and float32 arrays. Term ids refer to the vocabulary of
+    # index_version; after a refit the profile is rebuilt from the user's likes.
+    user_id = db.Column(db.Integer, db.ForeignKey('sign_up.id'), primary_key=True)
+    index_version = db.Column(db.String(64), nullable=False)
+    terms = db.Column(db.LargeBinary, nullable=False)
+    weights = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+# Profiles of recently active users are cached; a cached profile can miss likes
+# made through other workers for up to USER_PROFILE_CACHE_TTL seconds
+app.config['USER_PROFILE_WEIGHT'] = 0.3
+app.config['USER_PROFILE_QUERY_TERMS'] = 10
+app.config['USER_PROFILE_HALF_LIFE'] = user_profiles.DEFAULT_HALF_LIFE
+app.config['USER_PROFILE_CACHE_SIZE'] = 10000
+app.config['USER_PROFILE_CACHE_TTL'] = 60
+user_profile_cache = query_cache.LRUCache(maxsize=app.config['USER_PROFILE_CACHE_SIZE'],
+                                          ttl=app.config['USER_PROFILE_CACHE_TTL'])
+
+def load_user_profiles(session, user_ids, snapshot):
+    # {user_id: (profile, rebuilt)}: the stored profiles, plus profiles rebuilt from
+    # the likes of users with none yet or one that predates the current vocabulary.
+    # One query for the stored profiles and at most one for the likes.
+    table = UserProfile.__table__
+    n_terms = snapshot.index.matrix.shape[1]
+    profiles = {}
+    for record in session.execute(select(table).where(table.c.user_id.in_(user_ids))):
+        if record.index_version == snapshot.index.version:
+            profiles[record.user_id] = (user_profiles.Profile.from_record(record, n_terms), False)
+
+    rebuild = [user_id for user_id in user_ids if user_id not in profiles]
+    if rebuild:
+        liked = {user_id: [] for user_id in rebuild}
+        for user_id, recipe_id, created_at in session.query(
+                LikedRecipe.user_id, LikedRecipe.recipe_id, LikedRecipe.created_at).filter(
+                LikedRecipe.user_id.in_(rebuild)):
+            liked[user_id].append((recipe_id, created_at))
+        for user_id in rebuild:
+            profiles[user_id] = (user_profiles.build(snapshot, liked[user_id], app.config['USER_PROFILE_HALF_LIFE']),
+                                 True)
+    return profiles
+
+def get_user_profile(user_id, snapshot):
+    # Read-only: a rebuilt profile is only cached here and gets stored with the user's next like
+    profile = user_profile_cache.get(user_id)
+    if profile is None or profile.version != snapshot.index.version:
+        with app.app_context():
+            profile, _ = load_user_profiles(db.session, [user_id], snapshot)[user_id]
+        user_profile_cache.set(user_id, profile)
+    return profile
+
+def update_profiles(session, rows):
+    # Fold newly stored likes into their users' profiles, in the caller's transaction
+    # and before its commit: O(nnz) per like, one query for the stored profiles, and
+    # one upsert for all of them. Reads the stored profiles rather than the cache so
+    # likes through other workers are not overwritten. Profiles must never fail a
+    # like, so this runs in a savepoint; a profile that missed likes catches up on
+    # its next rebuild. Returns the new profiles, to cache once committed.
+    snapshot = catalogue.snapshot
+    liked = {}
+    for row in rows:
+        liked.setdefault(row['user_id'], []).append((row['recipe_id'], row['created_at']))
+    try:
+        with session.begin_nested():
+            profiles = {}
+            for user_id, (profile, rebuilt) in load_user_profiles(session, list(liked), snapshot).items():
+                if not rebuilt:
+                    # A rebuilt profile already includes these likes
+                    for recipe_id, created_at in liked[user_id]:
+                        profile.add(*snapshot.recipe_terms(recipe_id), user_profiles.seconds(created_at),
+                                    app.config['USER_PROFILE_HALF_LIFE'])
+                profiles[user_id] = profile
+            likes.upsert(session, UserProfile.__table__,
+                         [dict(profile.to_record(), user_id=user_id) for user_id, profile in profiles.items()],
+                         'user_id')
+    except Exception:
+        app.logger.exception('Updating the profiles of %d users failed', len(liked))
+        return {}
+    return profiles
+
+def store_likes(rows):
+    # Insert-or-ignore the likes and fold the new ones into their users' profiles,
+    # all in one transaction with a single commit. Returns the (user_id, recipe_id)
+    # pairs that were new. Needs an app context.
+    stored = likes.insert_likes(db.session, LikedRecipe.__table__, rows)
+    profiles = update_profiles(db.session, [row for row in rows if (row['user_id'], row['recipe_id']) in stored]) \
+        if stored else {}
+    db.session.commit()
+    for user_id, profile in profiles.items():
+        user_profile_cache.set(user_id, profile)
+    return stored
+
+def write_likes(rows):
+    with app.app_context():
+        store_likes(rows)
+
+# Optional write-behind buffer: likes are committed in batches every
+# LIKE_BUFFER_INTERVAL seconds or LIKE_BUFFER_MAX_ROWS rows instead of once per click
+app.config['LIKE_BUFFER_ENABLED'] = os.environ.get('LIKE_BUFFER_ENABLED') == '1'
+app.config['LIKE_BUFFER_MAX_ROWS'] = 500
+app.config['LIKE_BUFFER_INTERVAL'] = 0.2
+like_buffer = None
+
+# Item-item "also liked" model over LikedRecipe. It is loaded in the background and
+# then kept current by pulling only the likes added since the last sync.
+app.config['COLLAB_NEIGHBOURS'] = 20
+app.config['COLLAB_SYNC_INTERVAL'] = 30.0
+# Weight of the ingredient match against the collaborative score for logged-in users
+app.config['HYBRID_ALPHA'] = 0.7
+collab_model = collaborative.CoOccurrenceModel(n_neighbours=app.config['COLLAB_NEIGHBOURS'])
+
+def sync_collaborative():
+    with app.app_context():
+        rows = (db.session.query(LikedRecipe.id, LikedRecipe.user_id, LikedRecipe.recipe_id)
+                .filter(LikedRecipe.id > collab_model.last_like_id)
+                .order_by(LikedRecipe.id).all())
+    if collab_model.last_like_id == 0:
+        collab_model.load(rows)
+    else:
+        collab_model.update(rows)
+
+def run_collaborative_sync():
+    while True:
+        try:
+            sync_collaborative()
+        except Exception:
+            app.logger.exception('Collaborative model sync failed')
+        time.sleep(app.config['COLLAB_SYNC_INTERVAL'])
+
+
+# Per-worker timings of each request and of the stages inside it, plus the SQL
+# statements each request runs, exported at /metrics for Prometheus. Setting
+# PROFILE_SLOW_REQUESTS to a number of seconds also samples the stacks of every
+# request and writes flamegraph-ready .folded files for the ones slower than that.
+app.config['PROFILE_SLOW_REQUESTS'] = float(os.environ.get('PROFILE_SLOW_REQUESTS', 0))
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', 'profiles')
+with app.app_context():
+    metrics.track_queries(db.engine)
+profiler = None
+
+metrics.registry.callback('recipe_bowl_recommendation_cache_hits_total', 'Recommendation cache hits',
+                          lambda: recommendation_cache.stats()['hits'], kind='counter')
+metrics.registry.callback('recipe_bowl_recommendation_cache_misses_total', 'Recommendation cache misses',
+                          lambda: recommendation_cache.stats()['misses'], kind='counter')
+metrics.registry.callback('recipe_bowl_recommendation_coalesced_total',
+                          'Identical recommendation queries that shared an in-flight computation',
+                          lambda: recommendation_flight.coalesced, kind='counter')
+metrics.registry.callback('recipe_bowl_audio_coalesced_total',
+                          'Audio requests that shared a synthesis already in progress',
+                          lambda: audio_cache.coalesced, kind='counter')
+metrics.registry.callback('recipe_bowl_catalogue_recipes', 'Recipes in the current catalogue snapshot',
+                          lambda: len(catalogue.snapshot) if catalogue.loaded else 0)
+
+
+# Startup is split in two so that importing this module stays cheap (no index,
+# no scikit-learn or pandas, no threads) and so gunicorn --preload can share the
+# loaded index with its workers through fork (see gunicorn.conf.py):
+#   load_recommender()        maps the index and builds the suggester; touches no
+#                             database or threads, so it is safe before forking
+#   start_background_tasks()  starts this process's threads, once per process, and
+#                             warms the recommender in the background if needed
+# Without gunicorn both happen on the first request. /ready reports 503 until the
+# recommender is warm.
+recommender_ready = threading.Event()
+background_pid = None
+background_lock = threading.Lock()
+
+def load_recommender():
+    snapshot = catalogue.snapshot
+    refresh_suggester(snapshot)
+    if app.config['RECOMMENDATION_ENGINE'] == 'dense' and snapshot.dense is None:
+        app.logger.warning('Index %s has no embeddings, ranking with the sparse engine', snapshot.index.version)
+    recommender_ready.set()
+
+def warm_recommender():
+    try:
+        load_recommender()
+    except Exception:
+        app.logger.exception('Loading the recommender failed')
+
+def start_background_tasks():
+    global background_pid, like_buffer, profiler, scoring_pool, scoring_batcher
+    with background_lock:
+        # Threads do not survive a fork, so each worker starts its own
+        if background_pid == os.getpid():
+            return
+        background_pid = os.getpid()
+
+        catalogue.watch(app.config['CATALOGUE_REFRESH_INTERVAL'])
+        threading.Thread(target=run_collaborative_sync, name='collaborative-sync', daemon=True).start()
+        if app.config['LIKE_BUFFER_ENABLED']:
+            like_buffer = likes.LikeBuffer(write_likes, max_rows=app.config['LIKE_BUFFER_MAX_ROWS'],
+                                           flush_interval=app.config['LIKE_BUFFER_INTERVAL'])
+            atexit.register(like_buffer.close)
+        if app.config['PROFILE_SLOW_REQUESTS']:
+            profiler = metrics.SamplingProfiler(app.config['PROFILE_DIR'],
+                                                threshold=app.config['PROFILE_SLOW_REQUESTS'])
+        if app.config['SCORING_PROCESSES']:
+            scoring_pool = scoring.ScoringPool(app.config['SCORING_PROCESSES'])
+            atexit.register(scoring_pool.close)
+            threading.Thread(target=scoring_pool.start, name='scoring-pool-start', daemon=True).start()
+            scoring_batcher = scoring.MicroBatcher(scoring_pool.score, max_in_flight=app.config['SCORING_PROCESSES'],
+                                                   max_batch=app.config['SCORING_MAX_BATCH'])
+        if not recommender_ready.is_set():
+            threading.Thread(target=warm_recommender, name='recommender-warmup', daemon=True).start()
+
+@app.before_request
+def start_request_metrics():
+    if background_pid != os.getpid():
+        start_background_tasks()
+    metrics.begin_request()
+    if profiler is not None:
+        profiler.begin()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    stats = metrics.end_request(endpoint, response.status_code)
+    if profiler is not None and stats is not None:
+        path = profiler.end(endpoint, stats['duration'])
+        if path is not None:
+            app.logger.warning('Slow %s request (%.0fms, %d queries), profile in %s',
+                               endpoint, stats['duration'] * 1000, stats['queries'], path)
+    return response
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/ready')
+def ready():
+    # For load balancer readiness checks; never blocks on loading the index
+    if not recommender_ready.is_set():
+        return jsonify({'status': 'warming'}), 503
+    snapshot = catalogue.snapshot
+    return jsonify({'status': 'ready', 'recipes': len(snapshot), 'index_version': snapshot.version})
 
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_page('index.html')
 
 @app.route('/signup', methods=['GET', 'POST'])
 def signup():
@@ -115,16 +561,37 @@ def dashboard():
     if user_id:
         user = SignUp.query.get(user_id)
         if user:
-            # Retrieve liked recipes for the user
-            liked_recipes = LikedRecipe.query.filter_by(user_id=user_id).all()
-            return render_template('dashboard.html', user=user, liked_recipes=liked_recipes)
+            # Retrieve one page of liked recipes for the user, newest first
+            page = request.args.get('page', 1, type=int)
+            likes = (LikedRecipe.query.filter_by(user_id=user_id)
+                     .order_by(LikedRecipe.created_at.desc(), LikedRecipe.id.desc())
+                     .paginate(page=page, per_page=app.config['DASHBOARD_PAGE_SIZE'], error_out=False))
+
+            # Resolve the whole page against the catalogue in one lookup
+            recipes = catalogue.snapshot.lookup([like.recipe_id for like in likes.items])
+            liked_recipes = [recipes[like.recipe_id] for like in likes.items if like.recipe_id in recipes]
+            return render_template('dashboard.html', user=user, liked_recipes=liked_recipes, pagination=likes)
     flash('User not found', 'danger')
     return redirect(url_for('login'))
 
 
 @app.route('/about')
 def about():
-    return render_template('about.html')
+    return render_page('about.html')
+
+@app.route('/assets/<path:filename>')
+def hashed_asset(filename):
+    # Content-hashed files from static_assets.build; the name changes with the content
+    build_dir = app.config['ASSET_BUILD_DIR']
+    name, encoding = static_assets.choose_variant(build_dir, filename, request.accept_encodings)
+    response = send_from_directory(build_dir, name, mimetype=mimetypes.guess_type(filename)[0],
+                                   conditional=True, max_age=app.config['ASSET_MAX_AGE'])
+    if encoding is not None:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 
 @app.route('/logout', methods=['POST'])
@@ -144,48 +611,227 @@ def like_recipe(recipe_id):
             return jsonify({'error': 'User not logged in'}), 401
 
         # Check if the recipe ID is valid
-        if recipe_id not in recipe_df.index:
+        if not 0 <= recipe_id < len(catalogue.snapshot):
             return jsonify({'error': 'Invalid recipe ID'}), 400
 
-        # Check if the recipe is already liked by the user
-        if LikedRecipe.query.filter_by(user_id=user_id, recipe_id=recipe_id).first():
-            return jsonify({'message': 'Recipe already liked'})
+        created_at = datetime.utcnow()
+        if like_buffer is not None:
+            like_buffer.add(user_id, recipe_id, created_at)
+            return jsonify({'message': 'Recipe like queued'}), 202
 
-        # Add the liked recipe to the database
-        liked_recipe = LikedRecipe(user_id=user_id, recipe_id=recipe_id)
-        db.session.add(liked_recipe)
-        db.session.commit()
+        # Insert-or-ignore against the unique (user_id, recipe_id) constraint
+        if not store_likes([{'user_id': user_id, 'recipe_id': recipe_id, 'created_at': created_at}]):
+            return jsonify({'message': 'Recipe already liked'})
 
+        # Count the like right away in this worker; other workers pick it up on their next sync
+        collab_model.add_like(user_id, recipe_id)
         return jsonify({'message': 'Recipe liked successfully'})
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+def recommendation_text(recipe):
+    #Generate text for recommendation
+    return f"The recommended recipe is {recipe['name']} with ingredients {recipe['ingredients']} and steps for this recipe is {recipe['steps']}."
+
+@app.route('/play_audio/<int:recipe_id>')
+def play_audio(recipe_id):
+    snapshot = catalogue.snapshot
+    if not 0 <= recipe_id < len(snapshot):
+        return jsonify({'error': 'Invalid recipe ID'}), 404
+
+    text = recommendation_text(snapshot.recipes[recipe_id])
+    path = audio_cache.request(recipe_id, text)
+    if path is None:
+        error = audio_cache.error(recipe_id, text)
+        if error is not None:
+            return jsonify({'error': 'Audio generation failed: %s' % error}), 502
+        response = jsonify({'status': 'pending'})
+        response.headers['Retry-After'] = '1'
+        return response, 202
+
+    # conditional=True answers Range requests so browsers can seek and resume
+    return send_file(path, mimetype='audio/mpeg', conditional=True, max_age=86400)
+
 @app.route('/recommendation', methods=['GET'])
 def get_recommendation():
     try:
         ingredients_input = request.args.get('ingredients', '')
-        available_ingredients = ingredients_input.split(',')
+        available_ingredients = query_cache.normalize_ingredients(ingredients_input.split(','))
 
         if not available_ingredients:
             return jsonify({'error': 'Please provide a list of ingredients.'}), 400
 
-        recommended_recipe = recommend_recipe(available_ingredients, recipe_df, vectorizer)
-
-        #Generate text for recommendation
-        recommendation_text = f"The recommended recipe is {recommended_recipe['name']} with ingredients {recommended_recipe['ingredients']} and steps for this recipe is {recommended_recipe['steps']}."
+        k = request.args.get('k', recommender.DEFAULT_K, type=int)
+        offset = request.args.get('offset', 0, type=int)
+        if not 1 <= k <= recommender.MAX_K or offset < 0:
+            return jsonify({'error': 'k must be between 1 and %d and offset must not be negative.' % recommender.MAX_K}), 400
 
-        # Convert text to speech
-        tts = gTTS(text=recommendation_text, lang='en')
-        tts.save('recommendation.mp3')
+        # Optional ?max_ingredients=8&include=garlic&exclude=peanut,green chilli
+        try:
+            filter_args = filters.parse_filters(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        # Play the generated speech
-        os.system('start recommendation.mp3')
-
-        return render_template('recommendation.html', recommended_recipe=recommended_recipe)
+        # A page that isn't personalized depends only on the normalized query and the
+        # catalogue, so a client or CDN holding it revalidates without any scoring
+        snapshot = catalogue.snapshot
+        user_id = session.get('user_id')
+        etag = None
+        if not is_personalized(user_id):
+            etag = query_cache.make_etag(app.config['SITE_VERSION'], app.config['RECOMMENDATION_ENGINE'],
+                                         snapshot.version, available_ingredients, k, offset, filter_args)
+            if request.if_none_match.contains_weak(etag):
+                return not_modified(etag)
+
+        recommended_recipes = recommend_recipe(available_ingredients, snapshot, k=k, offset=offset,
+                                               user_id=user_id, filter_args=filter_args)
+        if not recommended_recipes:
+            return jsonify({'error': 'No more recipes for these ingredients.'}), 404
+
+        recommended_recipe = recommended_recipes[0]
+
+        # Queue speech for the top recipe in the background; /play_audio serves it once
+        # ready, or reports why it failed
+        with metrics.span('audio'):
+            audio_cache.request(recommended_recipe['recipe_id'], recommendation_text(recommended_recipe))
+
+        with metrics.span('render'):
+            response = app.make_response(render_template(
+                'recommendation.html', recommended_recipes=recommended_recipes,
+                ingredients=','.join(available_ingredients), k=k, offset=offset,
+                filter_args=filters.query_args(filter_args),
+                has_more=offset + k < filters.count_allowed(snapshot, **filter_args)))
+        if etag is None:
+            response.cache_control.private = True
+        else:
+            response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/ingredients/suggest')
+def suggest_ingredients():
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', app.config['SUGGEST_LIMIT'], type=int)
+    if not 1 <= limit <= app.config['SUGGEST_MAX_LIMIT']:
+        return jsonify({'error': 'limit must be between 1 and %d.' % app.config['SUGGEST_MAX_LIMIT']}), 400
+    return jsonify({'query': query, 'suggestions': refresh_suggester(catalogue.snapshot).suggest(query, limit)})
+
+@app.route('/api/cache/stats')
+def get_cache_stats():
+    return jsonify(dict(recommendation_cache.stats(), coalesced=recommendation_flight.coalesced))
+
+# Queries are scored in blocks of this size so memory stays bounded for huge batches
+BATCH_CHUNK_SIZE = 512
+# The dense engine scores every recipe, a float32 per query and recipe, so its
+# blocks are also capped at this many bytes of scores
+BATCH_DENSE_SCORE_BYTES = 64 * 1024 * 1024
+BATCH_MAX_QUERIES = 10000
+# Batches larger than this are streamed back as NDJSON instead of one JSON document
+BATCH_STREAM_THRESHOLD = 1000
+
+def recommend_batch(queries, k):
+    snapshot = catalogue.snapshot
+    dense = dense_index(snapshot)
+    chunk_size = BATCH_CHUNK_SIZE
+    if dense is not None:
+        chunk_size = max(1, min(chunk_size, BATCH_DENSE_SCORE_BYTES // (4 * len(snapshot))))
+
+    for start in range(0, len(queries), chunk_size):
+        chunk = queries[start:start + chunk_size]
+
+        # One sparse query matrix and one matmul for the whole chunk
+        input_vectors = snapshot.vectorizer.transform([' '.join(ingredients) for ingredients in chunk])
+        if dense is not None:
+            ranked = recommender.top_k_dense(dense.score(input_vectors), k)
+        else:
+            ranked = recommender.top_k_batch(score_queries(snapshot, input_vectors), len(snapshot), k)
+
+        for ids, scores in ranked:
+            yield [{'recipe_id': recipe_id, 'name': snapshot.recipes.value(recipe_id, 'name'),
+                    'url': snapshot.recipes.value(recipe_id, 'url'), 'score': score}
+                   for recipe_id, score in zip(ids.tolist(), scores.tolist())]
+
+@app.route('/api/recommendations/batch', methods=['POST'])
+def get_recommendations_batch():
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'The request body must be a JSON object.'}), 400
+    queries = payload.get('queries')
+    k = payload.get('k', recommender.DEFAULT_K)
+
+    if not isinstance(queries, list) or not queries:
+        return jsonify({'error': 'Please provide a non-empty list of queries.'}), 400
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify({'error': 'At most %d queries per batch.' % BATCH_MAX_QUERIES}), 400
+    if not isinstance(k, int) or not 1 <= k <= recommender.MAX_K:
+        return jsonify({'error': 'k must be between 1 and %d.' % recommender.MAX_K}), 400
+
+    # Each query is either a list of ingredients or a comma separated string
+    queries = [query.split(',') if isinstance(query, str) else query for query in queries]
+    if not all(isinstance(query, list) and all(isinstance(item, str) for item in query) for query in queries):
+        return jsonify({'error': 'Each query must be a list of ingredients or a comma separated string.'}), 400
+    queries = [query_cache.normalize_ingredients(query) for query in queries]
+
+    results = recommend_batch(queries, k)
+
+    stream = payload.get('stream', len(queries) > BATCH_STREAM_THRESHOLD)
+    if stream or 'application/x-ndjson' in request.headers.get('Accept', ''):
+        lines = (json.dumps({'query': i, 'recipes': recipes}) + '\n' for i, recipes in enumerate(results))
+        return Response(lines, mimetype='application/x-ndjson')
+
+    return jsonify({'results': [{'query': i, 'recipes': recipes} for i, recipes in enumerate(results)]})
+
+@app.route('/api/recipes', methods=['POST'])
+def ingest_recipes():
+    api_key = app.config['INGEST_API_KEY']
+    if not api_key or request.headers.get('X-Api-Key') != api_key:
+        return jsonify({'error': 'Not authorized'}), 403
+
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'The request body must be a JSON object.'}), 400
+    recipes = payload.get('recipes')
+    if not isinstance(recipes, list) or not recipes:
+        return jsonify({'error': 'Please provide a non-empty list of recipes.'}), 400
+
+    try:
+        recipe_ids = catalogue.ingest(recipes)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except NoIndexError as e:
+        return jsonify({'error': str(e)}), 409
+
+    return jsonify({'recipe_ids': recipe_ids}), 201
+
+@app.route('/api/recipes/<int:recipe_id>/also_liked')
+def get_also_liked(recipe_id):
+    snapshot = catalogue.snapshot
+    if not 0 <= recipe_id < len(snapshot):
+        return jsonify({'error': 'Invalid recipe ID'}), 404
+
+    ids, scores = collab_model.similar(recipe_id)
+    recipes = snapshot.lookup(ids.tolist())
+    return jsonify({'recipe_id': recipe_id, 'recipes': [
+        {'recipe_id': other, 'name': recipes[other]['name'], 'url': recipes[other]['url'], 'score': score}
+        for other, score in zip(ids.tolist(), scores.tolist()) if other in recipes]})
+
+@app.cli.command('migrate-likes')
+def migrate_likes():
+    # flask --app app migrate-likes: creates the new tables, then brings a liked_recipe
+    # table from before the unique (user_id, recipe_id) constraint up to date. Run it
+    # before deploying; it does nothing on a database that is already up to date.
+    db.create_all()
+    with db.engine.begin() as connection:
+        affected = likes.migrate(connection, LikedRecipe.__table__)
+        # Those users' stored profiles counted the duplicates; they are rebuilt from the likes
+        if affected:
+            connection.execute(delete(UserProfile.__table__).where(UserProfile.user_id.in_(affected)))
+    print('Removed the duplicate likes of %d users' % len(affected))
+
 if __name__ == "__main__":
     app.run(debug=True)
 
@@ -0,0 +1,191 @@
+import asyncio
+import os
+from datetime import datetime
+
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+from flask import flash, jsonify, redirect, render_template, request, session, url_for
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import likes
+import metrics
+from app import LikedRecipe, SignUp, app, catalogue, collab_model, start_background_tasks
+import app as web
+
+# Async serving mode: the same app, routes and templates behind an ASGI server,
+#   uvicorn asgi:application --workers 4
+# The views that mostly wait on the database (signup, login, dashboard,
+# like_recipe) are replaced with async versions using an async driver
+# (aiosqlite, aiomysql or asyncpg), so those waits run on the server's event loop.
+# Everything else, recommendation scoring included, runs on worker threads, at
+# most ASYNC_MAX_THREADS requests at a time, off the event loop.
+# Needs: pip install "flask[async]" uvicorn aiosqlite (or aiomysql)
+
+# Async drivers for the database URLs the sync app accepts
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'mysql': 'mysql+aiomysql', 'postgresql': 'postgresql+asyncpg'}
+
+
+def async_database_url(url):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+app.config['ASYNC_DATABASE_URI'] = (os.environ.get('ASYNC_DATABASE_URL')
+                                    or async_database_url(app.config['SQLALCHEMY_DATABASE_URI']))
+app.config['ASYNC_MAX_THREADS'] = int(os.environ.get('ASYNC_MAX_THREADS', 64))
+async_engine = create_async_engine(app.config['ASYNC_DATABASE_URI'])
+AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+metrics.track_queries(async_engine.sync_engine)
+
+
+class Page:
+    # The parts of Flask-SQLAlchemy's Pagination that dashboard.html uses
+    def __init__(self, items, page, has_next):
+        self.items = items
+        self.page = page
+        self.has_prev = page > 1
+        self.has_next = has_next
+        self.prev_num = page - 1 if self.has_prev else None
+        self.next_num = page + 1 if has_next else None
+
+
+async def signup():
+    if request.method == 'POST':
+        name = request.form.get('name')
+        phone = request.form.get('phone')
+        email = request.form.get('email')
+        username = request.form.get('username')
+        password = request.form.get('password')
+
+        async with AsyncSession() as db_session:
+            # Check if the username or email already exists
+            existing = await db_session.scalar(
+                select(SignUp).where((SignUp.username == username) | (SignUp.email == email)).limit(1))
+            if existing is not None:
+                flash('Username or email already exists. Please choose a different one.', 'danger')
+            else:
+                db_session.add(SignUp(name=name, phone=phone, email=email, username=username, password=password))
+                try:
+                    await db_session.commit()
+                    flash('Registration successful!', 'success')
+                    return redirect(url_for('index'))
+                except Exception:
+                    await db_session.rollback()
+                    flash('Error during registration. Please try again.', 'danger')
+
+    return render_template('signup.html')
+
+
+async def login():
+    if 'user_id' in session:
+        flash('You are already logged in.', 'info')
+        return redirect(url_for('dashboard'))
+
+    if request.method == 'POST':
+        async with AsyncSession() as db_session:
+            user = await db_session.scalar(
+                select(SignUp).where(SignUp.username == request.form.get('username'),
+                                     SignUp.password == request.form.get('password')).limit(1))
+
+        if user:
+            session['user_id'] = user.id
+            flash('Login successful!', 'success')
+            return redirect(url_for('dashboard'))
+        flash('Invalid username or password. Please try again.', 'danger')
+
+    return render_template('login.html')
+
+
+async def dashboard():
+    user_id = session.get('user_id')
+    if user_id:
+        async with AsyncSession() as db_session:
+            user = await db_session.get(SignUp, user_id)
+            if user:
+                # One page of liked recipes, newest first, plus one row to tell whether there is a next page
+                page = max(request.args.get('page', 1, type=int), 1)
+                per_page = app.config['DASHBOARD_PAGE_SIZE']
+                rows = (await db_session.scalars(
+                    select(LikedRecipe).where(LikedRecipe.user_id == user_id)
+                    .order_by(LikedRecipe.created_at.desc(), LikedRecipe.id.desc())
+                    .offset((page - 1) * per_page).limit(per_page + 1))).all()
+                pagination = Page(rows[:per_page], page, len(rows) > per_page)
+
+                recipes = catalogue.snapshot.lookup([like.recipe_id for like in pagination.items])
+                liked_recipes = [recipes[like.recipe_id] for like in pagination.items if like.recipe_id in recipes]
+                return render_template('dashboard.html', user=user, liked_recipes=liked_recipes,
+                                       pagination=pagination)
+    flash('User not found', 'danger')
+    return redirect(url_for('login'))
+
+
+async def like_recipe(recipe_id):
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'User not logged in'}), 401
+    if not 0 <= recipe_id < len(catalogue.snapshot):
+        return jsonify({'error': 'Invalid recipe ID'}), 400
+
+    created_at = datetime.utcnow()
+    if web.like_buffer is not None:
+        web.like_buffer.add(user_id, recipe_id, created_at)
+        return jsonify({'message': 'Recipe like queued'}), 202
+
+    async with AsyncSession() as db_session:
+        try:
+            row = {'user_id': user_id, 'recipe_id': recipe_id, 'created_at': created_at}
+            inserted = await likes.insert_likes_async(db_session, LikedRecipe.__table__, [row])
+            # The profile update joins the like's transaction, as in web.store_likes
+            profiles = await db_session.run_sync(web.update_profiles, [row]) if inserted else {}
+            await db_session.commit()
+        except Exception as e:
+            await db_session.rollback()
+            return jsonify({'error': str(e)}), 500
+
+    if not inserted:
+        return jsonify({'message': 'Recipe already liked'})
+    collab_model.add_like(user_id, recipe_id)
+    if user_id in profiles:
+        web.user_profile_cache.set(user_id, profiles[user_id])
+    return jsonify({'message': 'Recipe liked successfully'})
+
+
+# Same endpoints, so url_for() and the templates are unchanged
+for view in (signup, login, dashboard, like_recipe):
+    app.view_functions[view.__name__] = view
+
+
+class AsyncApp:
+    # ASGI application around the Flask app. asgiref's WsgiToAsgi runs every
+    # request on one shared thread unless each request gets its own context, so
+    # each request gets a thread of its own, with at most max_threads at once.
+    # Async views called from those threads run on the server's event loop.
+
+    def __init__(self, wsgi_app, max_threads):
+        self.wsgi = WsgiToAsgi(wsgi_app)
+        self.slots = asyncio.Semaphore(max_threads)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        async with self.slots:
+            async with ThreadSensitiveContext():
+                await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Threads and the recommender warm-up of this worker process
+                await asyncio.get_running_loop().run_in_executor(None, start_background_tasks)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await async_engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+application = AsyncApp(app, app.config['ASYNC_MAX_THREADS'])
@@ -0,0 +1,104 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import query_cache
+
+logger = logging.getLogger(__name__)
+
+
+def gtts_engine(text, path):
+    # Default text-to-speech engine; any callable(text, path) that writes an mp3 works
+    from gtts import gTTS
+    gTTS(text=text, lang='en').save(path)
+
+
+class AudioCache:
+    # Synthesizes recommendation audio on a background pool and keeps the mp3 files
+    # in <cache_dir>/<recipe_id>/<sha256 of text>.mp3, so identical text is only
+    # ever synthesized once and concurrent requests never overwrite each other.
+
+    def __init__(self, cache_dir, engine=gtts_engine, max_bytes=256 * 1024 * 1024, workers=2, retry_after=30.0,
+                 max_failures=1024):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.engine = engine
+        self.max_bytes = max_bytes
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tts')
+        self._jobs = {}
+        # path -> error of the last failed synthesis, kept for retry_after seconds. A
+        # failing engine fails for every recipe and text, so the entries are bounded.
+        self._failures = query_cache.LRUCache(maxsize=max_failures, ttl=retry_after)
+        self._lock = threading.Lock()
+        # Requests that found their audio already being synthesized and shared that job
+        self.coalesced = 0
+
+    def path_for(self, recipe_id, text):
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, str(recipe_id), digest + '.mp3')
+
+    def request(self, recipe_id, text):
+        # Return the cached file if it is ready, otherwise make sure a job is queued
+        # and return None. Never raises: a failed synthesis is kept for error() to
+        # report until it is retried, retry_after seconds later.
+        path = self.path_for(recipe_id, text)
+        try:
+            # Touch the file so eviction drops the least recently played audio first
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+
+        with self._lock:
+            if path in self._jobs:
+                self.coalesced += 1
+                return None
+            if self._failures.get(path) is not None:
+                return None
+            self._jobs[path] = self._executor.submit(self._synthesize, text, path)
+        return None
+
+    def error(self, recipe_id, text):
+        # The error of the last synthesis of this audio if it failed, else None
+        return self._failures.get(self.path_for(recipe_id, text))
+
+    def _synthesize(self, text, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a private temp file and rename, so readers never see a partial mp3
+        tmp_path = '%s.%d.tmp' % (path, threading.get_ident())
+        try:
+            self.engine(text, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.exception('Speech synthesis failed for %s', path)
+            self._failures.set(path, e)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with self._lock:
+                del self._jobs[path]
+        self._evict()
+
+    def _evict(self):
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith('.mp3'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
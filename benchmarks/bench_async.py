@@ -0,0 +1,146 @@
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.harness import build_catalogue, import_app, save_results, silent_engine
+from benchmarks.load_test import HTTPSession, run_load, seed_database
+from benchmarks.synthetic import generate_queries
+
+# Concurrent clients served by the sync mode (a fixed number of sync workers, as
+# with gunicorn's default worker class) against the async mode (asgi.py under
+# uvicorn), on the database-bound routes. SQLite answers in microseconds, so
+# --db-latency adds a MySQL-like round trip to every statement:
+#   python -m benchmarks.bench_async --concurrency 8 32 128 --db-latency 0.01
+# Needs uvicorn, aiosqlite and flask[async]. SQLite takes one writer at a time, so
+# a like-heavy mix measures its write lock rather than the server; the default
+# mix is mostly dashboard reads.
+
+DEFAULT_MIX = 'dashboard=80,like=20'
+
+
+def add_latency(engine, latency):
+    # Sleep before every statement on the thread that runs it. With aiosqlite that
+    # is the connection's own thread, so the event loop is not held up.
+    from sqlalchemy import event
+
+    def trace(statement):
+        time.sleep(latency)
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        if hasattr(dbapi_connection, 'run_async'):
+            dbapi_connection.run_async(lambda connection: connection.set_trace_callback(trace))
+        else:
+            dbapi_connection.set_trace_callback(trace)
+
+
+def serve(mode, port, workers, latency):
+    # Runs in a child process: one server, sync or async
+    import app
+    app.app.config['TTS_ENGINE'] = silent_engine
+    with app.app.app_context():
+        add_latency(app.db.engine, latency)
+
+    if mode == 'async':
+        import uvicorn
+        import asgi
+        add_latency(asgi.async_engine.sync_engine, latency)
+        uvicorn.run(asgi.application, port=port, log_level='warning')
+        return
+
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    class SyncWorkersServer(BaseWSGIServer):
+        # At most `workers` requests in progress, each holding its worker until it is done
+        def process_request(self, request, client_address):
+            pool.submit(self.process_request_thread, request, client_address)
+
+        def process_request_thread(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    pool = ThreadPoolExecutor(workers)
+    server = SyncWorkersServer('127.0.0.1', port, app.app, handler=QuietHandler)
+    server.request_queue_size = 1024
+    server.serve_forever()
+
+
+def start_server(mode, port, workers, latency):
+    process = subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_async', '--serve', mode, '--port', str(port),
+                                '--sync-workers', str(workers), '--db-latency', str(latency)])
+    for _ in range(600):
+        try:
+            with urllib.request.urlopen('http://127.0.0.1:%d/about' % port):
+                return process
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('%s server did not start' % mode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare concurrent clients served in sync and async mode.')
+    parser.add_argument('--recipes', type=int, default=20000)
+    parser.add_argument('--vocab-size', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--likes-per-user', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 32, 128])
+    parser.add_argument('--requests', type=int, default=1000, help='Requests per concurrency level')
+    parser.add_argument('--sync-workers', type=int, default=8, help='Requests the sync mode serves at once')
+    parser.add_argument('--db-latency', type=float, default=0.01, help='Seconds added to every SQL statement')
+    parser.add_argument('--mix', default=DEFAULT_MIX)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--serve', choices=['sync', 'async'], help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.sync_workers, args.db_latency)
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directory:
+        # The servers inherit the environment import_app sets up
+        csv_path, index_dir, _ = build_catalogue(directory, args.recipes, args.vocab_size)
+        app = import_app(directory, csv_path, index_dir)
+        seed_database(app, args.users, args.likes_per_user, args.recipes)
+        queries = generate_queries(200, vocab_size=args.vocab_size)
+
+        print('%-6s %11s %10s %7s %10s %10s' % ('mode', 'concurrency', 'requests/s', 'errors', 'p50', 'p99'))
+        for mode in ('sync', 'async'):
+            server = start_server(mode, args.port, args.sync_workers, args.db_latency)
+            try:
+                base_url = 'http://127.0.0.1:%d' % args.port
+                for concurrency in args.concurrency:
+                    load_args = Namespace(mix=args.mix, users=args.users, requests=args.requests,
+                                          concurrency=concurrency, k=5, hot_share=0.0)
+                    total = run_load(app, lambda: HTTPSession(base_url), load_args, queries, args.recipes)[-1]
+                    result = dict(total, endpoint=mode, concurrency=concurrency)
+                    results.append(result)
+                    print('%-6s %11d %10.0f %7d %8.2fms %8.2fms' % (
+                        mode, concurrency, result['requests_per_s'], result['errors'],
+                        result['p50_ms'], result['p99_ms']))
+            finally:
+                server.terminate()
+                server.wait()
+
+    if args.output:
+        save_results(args.output, 'async', args, results)
+
+
+if __name__ == '__main__':
+    main()
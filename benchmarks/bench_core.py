@@ -0,0 +1,105 @@
+import argparse
+import multiprocessing
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.harness import build_catalogue, import_app, memory_usage, percentiles, save_results
+from benchmarks.synthetic import generate_queries
+
+# Microbenchmarks of the recommender core on synthetic catalogues: index build,
+# worker startup (importing the app, then loading the index), recommend_recipe
+# latency with and without the result cache, and memory per worker and per query:
+#   python -m benchmarks.bench_core --sizes 10000 100000 --output core.json
+
+
+def measure_worker(directory, csv_path, index_dir, n_queries, vocab_size, k):
+    # Runs in a fresh process so every size starts from an empty interpreter
+    anonymous_before, rss_before = memory_usage()
+    start = time.perf_counter()
+    app = import_app(directory, csv_path, index_dir)
+    startup = time.perf_counter() - start
+    start = time.perf_counter()
+    app.load_recommender()
+    warmup = time.perf_counter() - start
+    anonymous_after, rss_after = memory_usage()
+
+    snapshot = app.catalogue.snapshot
+    queries = generate_queries(n_queries, vocab_size=vocab_size)
+
+    # Cold: every query is computed
+    cold = []
+    for query in queries:
+        app.recommendation_cache.clear()
+        start = time.perf_counter()
+        app.recommend_recipe(query, snapshot, k=k)
+        cold.append(time.perf_counter() - start)
+
+    # Warm: the same queries again, now answered from the cache
+    for query in queries:
+        app.recommend_recipe(query, snapshot, k=k)
+    warm = []
+    for query in queries:
+        start = time.perf_counter()
+        app.recommend_recipe(query, snapshot, k=k)
+        warm.append(time.perf_counter() - start)
+
+    # Peak Python allocations of one computed query (tracemalloc slows the calls,
+    # so this is kept apart from the timings)
+    peaks = []
+    tracemalloc.start()
+    for query in queries[:100]:
+        app.recommendation_cache.clear()
+        tracemalloc.reset_peak()
+        app.recommend_recipe(query, snapshot, k=k)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    result = {
+        'startup_s': startup,
+        'warmup_s': warmup,
+        'worker_anonymous_mb': anonymous_after - anonymous_before,
+        'worker_rss_mb': rss_after - rss_before,
+        'query_peak_kb': float(np.median(peaks)) / 1024,
+    }
+    result.update(percentiles(cold, 'cold_'))
+    result.update(percentiles(warm, 'warm_'))
+    return result
+
+
+def run(size, n_queries, vocab_size, k, steps_length):
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directory:
+        csv_path, index_dir, build_seconds = build_catalogue(directory, size, vocab_size, steps_length)
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            result = pool.apply(measure_worker, (directory, csv_path, index_dir, n_queries, vocab_size, k))
+    return dict({'recipes': size, 'build_s': build_seconds}, **result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark index build and recommend_recipe on synthetic catalogues.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 500000])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--vocab-size', type=int, default=2000)
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--steps-length', type=int, default=500, help='Characters of steps text per recipe')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = []
+    print('%10s %9s %9s %9s %10s %10s %10s %11s' % ('recipes', 'build', 'startup', 'warmup', 'cold p50',
+                                                    'cold p99', 'warm p50', 'worker heap'))
+    for size in args.sizes:
+        result = run(size, args.queries, args.vocab_size, args.k, args.steps_length)
+        results.append(result)
+        print('%10d %8.2fs %8.2fs %8.2fs %8.2fms %8.2fms %8.3fms %9.1fMB' % (
+            size, result['build_s'], result['startup_s'], result['warmup_s'], result['cold_p50_ms'], result['cold_p99_ms'],
+            result['warm_p50_ms'], result['worker_anonymous_mb']))
+
+    if args.output:
+        save_results(args.output, 'core', args, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics.pairwise import linear_kernel
+
+import embeddings
+import recipe_index
+import recommender
+from benchmarks.harness import save_results
+from benchmarks.synthetic import generate_queries, generate_recipes
+
+# Recall, latency and memory of the dense (LSA) engine at several sizes and
+# precisions, against the exact sparse scorers on the same catalogue:
+#   python -m benchmarks.bench_dense --sizes 100000 --dims 64 128 256
+#   python -m benchmarks.bench_dense --csv recipes1.csv
+# Recall is the share of the exact top k that the dense engine also returns.
+# Synthetic ingredients co-occur at random, which gives LSA nothing to learn, so
+# the real catalogue is the better judge of recall.
+
+
+def sample_queries(recipe_df, n_queries, min_terms=3, max_terms=6, seed=1):
+    # Pantry-style queries out of the ingredient lists of random recipes
+    rng = np.random.default_rng(seed)
+    queries = []
+    for text in recipe_df['ingredients'].sample(n_queries, replace=True, random_state=seed):
+        items = text.split(', ')
+        queries.append(list(rng.choice(items, size=min(len(items), rng.integers(min_terms, max_terms + 1)),
+                                       replace=False)))
+    return queries
+
+
+def sparse_nbytes(index):
+    return sum(getattr(matrix, name).nbytes for matrix in (index.matrix, index.postings)
+               for name in recipe_index.MATRIX_FILES)
+
+
+def linear_kernel_top_k(input_vector, index, k):
+    return recommender.top_k(linear_kernel(input_vector, index.matrix).flatten(), k)[0]
+
+
+def inverted_top_k(input_vector, index, k):
+    scores = recommender.score_candidates(input_vector, index.postings)
+    return recommender.top_k_candidates(scores.indices, scores.data, index.matrix.shape[0], k)[0]
+
+
+def dense_top_k(dense):
+    def top_k(input_vector, index, k):
+        candidate_ids, scores = dense.candidates(input_vector)
+        return recommender.top_k_candidates(candidate_ids, scores, len(dense), k)[0]
+    return top_k
+
+
+def measure(func, input_vectors, index, k, exact):
+    timings, hits, relevant = [], 0, 0
+    for input_vector, expected in zip(input_vectors, exact):
+        start = time.perf_counter()
+        ids = func(input_vector, index, k)
+        timings.append((time.perf_counter() - start) * 1000)
+        hits += len(np.intersect1d(ids, expected))
+        relevant += len(expected)
+    return {
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p99_ms': float(np.percentile(timings, 99)),
+        'recall_at_k': hits / max(relevant, 1),
+    }
+
+
+def run(recipe_df, queries, dims_list, dtypes, k):
+    index = recipe_index.fit_index(recipe_df)
+    input_vectors = [index.vectorizer.transform([' '.join(query)]) for query in queries]
+
+    # The exact answer: recipes in the sparse top k that share a term with the query
+    exact = []
+    for input_vector in input_vectors:
+        scores = recommender.score_candidates(input_vector, index.postings)
+        ids, top_scores = recommender.top_k_candidates(scores.indices, scores.data, index.matrix.shape[0], k)
+        exact.append(ids[top_scores > 0])
+
+    results = []
+    for strategy, func in (('linear_kernel', linear_kernel_top_k), ('inverted', inverted_top_k)):
+        result = {'recipes': len(recipe_df), 'strategy': strategy, 'index_mb': sparse_nbytes(index) / 2 ** 20}
+        result.update(measure(func, input_vectors, index, k, exact))
+        results.append(result)
+
+    for dims in dims_list:
+        for dtype in dtypes:
+            start = time.perf_counter()
+            dense = embeddings.fit(index.matrix, dims, dtype)
+            fit_s = time.perf_counter() - start
+            result = {'recipes': len(recipe_df), 'strategy': 'dense_%s_%d' % (dtype, dims),
+                      'index_mb': dense.nbytes / 2 ** 20, 'fit_s': fit_s}
+            result.update(measure(dense_top_k(dense), input_vectors, index, k, exact))
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the dense LSA engine against the sparse scorers.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20000, 100000])
+    parser.add_argument('--csv', help='Use this recipes CSV instead of synthetic catalogues')
+    parser.add_argument('--dims', type=int, nargs='+', default=[64, 128, 256])
+    parser.add_argument('--dtypes', nargs='+', choices=embeddings.DTYPES, default=list(embeddings.DTYPES))
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--vocab-size', type=int, default=2000)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    if args.csv:
+        recipe_df = pd.read_csv(args.csv)
+        catalogues = [(recipe_df, sample_queries(recipe_df, args.queries))]
+    else:
+        catalogues = [(generate_recipes(size, vocab_size=args.vocab_size),
+                       generate_queries(args.queries, vocab_size=args.vocab_size)) for size in args.sizes]
+
+    results = []
+    print('%10s %-20s %10s %10s %10s %9s' % ('recipes', 'strategy', 'p50', 'p99', 'index', 'recall'))
+    for recipe_df, queries in catalogues:
+        for result in run(recipe_df, queries, args.dims, args.dtypes, args.k):
+            results.append(result)
+            print('%10d %-20s %8.2fms %8.2fms %8.1fMB %9.3f' % (
+                result['recipes'], result['strategy'], result['p50_ms'], result['p99_ms'],
+                result['index_mb'], result['recall_at_k']))
+
+    if args.output:
+        save_results(args.output, 'dense', args, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import index_builder
+import recipe_index
+from benchmarks.harness import save_results
+from benchmarks.synthetic import generate_recipes
+
+# Build time and peak memory of the in-memory index build against the streaming
+# builder, each in a fresh process:
+#   python -m benchmarks.bench_index_build --sizes 100000 1000000 --chunk-size 50000 --processes 0 2
+# Peak memory of the streaming build should stay flat as the catalogue grows.
+
+
+def peak_rss():
+    # VmHWM in MB (Linux only). Unlike ru_maxrss it starts over at exec, so it
+    # doesn't include the benchmark process this one was started from.
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+
+
+def measure(csv_path, index_dir, chunk_size, processes):
+    start = time.perf_counter()
+    if chunk_size:
+        index_builder.build_index(csv_path, index_dir, chunk_size, processes)
+    else:
+        recipe_index.build_index(csv_path, index_dir)
+    elapsed = time.perf_counter() - start
+    return {
+        'build_s': elapsed,
+        'peak_rss_mb': peak_rss(),
+        # The largest pool process once they have exited; ru_maxrss is in kB on Linux
+        'pool_peak_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the in-memory index build against the streaming builder.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 400000])
+    parser.add_argument('--vocab-size', type=int, default=5000)
+    parser.add_argument('--chunk-size', type=int, default=index_builder.DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--processes', type=int, nargs='+', default=[0, 2])
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = []
+    print('%10s %-14s %10s %10s %10s' % ('recipes', 'strategy', 'build', 'peak rss', 'pool peak'))
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directory:
+        for size in args.sizes:
+            csv_path = os.path.join(directory, 'recipes_%d.csv' % size)
+            generate_recipes(size, vocab_size=args.vocab_size).to_csv(csv_path, index=False)
+            runs = [('in_memory', 0, 0)] + [('streaming_%d' % processes, args.chunk_size, processes)
+                                            for processes in args.processes]
+            for strategy, chunk_size, processes in runs:
+                with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as runner:
+                    result = runner.submit(measure, csv_path, os.path.join(directory, 'index_%d' % size),
+                                           chunk_size, processes).result()
+                result.update(recipes=size, strategy=strategy)
+                results.append(result)
+                print('%10d %-14s %9.2fs %8.0fMB %8.0fMB' % (
+                    size, strategy, result['build_s'], result['peak_rss_mb'], result['pool_peak_rss_mb']))
+
+    if args.output:
+        save_results(args.output, 'index_build', args, results)
+
+
+if __name__ == '__main__':
+    main()
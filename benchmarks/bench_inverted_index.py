@@ -0,0 +1,83 @@
+import argparse
+import time
+
+import numpy as np
+from sklearn.metrics.pairwise import linear_kernel
+
+import recipe_index
+import recommender
+from benchmarks.harness import save_results
+from benchmarks.synthetic import generate_queries, generate_recipes
+
+# Compare the old dense linear_kernel scorer with the inverted-index scorer:
+#   python -m benchmarks.bench_inverted_index --sizes 6000 100000 1000000
+
+
+def dense_top_k(input_vector, index, k):
+    cosine_similarities = linear_kernel(input_vector, index.matrix).flatten()
+    return recommender.top_k(cosine_similarities, k)
+
+
+def inverted_top_k(input_vector, index, k):
+    scores = recommender.score_candidates(input_vector, index.postings)
+    return recommender.top_k_candidates(scores.indices, scores.data, index.matrix.shape[0], k)
+
+
+def time_queries(func, input_vectors, index, k):
+    timings = []
+    for input_vector in input_vectors:
+        start = time.perf_counter()
+        func(input_vector, index, k)
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.percentile(timings, 50), np.percentile(timings, 99)
+
+
+def run(size, n_queries, vocab_size, k):
+    recipe_df = generate_recipes(size, vocab_size=vocab_size)
+    index = recipe_index.fit_index(recipe_df)
+    queries = generate_queries(n_queries, vocab_size=vocab_size)
+    input_vectors = [index.vectorizer.transform([' '.join(query)]) for query in queries]
+
+    # The two scorers must agree exactly before their timings mean anything
+    for input_vector in input_vectors:
+        dense_ids, dense_scores = dense_top_k(input_vector, index, k)
+        ids, scores = inverted_top_k(input_vector, index, k)
+        assert np.array_equal(dense_ids, ids) and np.allclose(dense_scores, scores)
+
+    dense_p50, dense_p99 = time_queries(dense_top_k, input_vectors, index, k)
+    inverted_p50, inverted_p99 = time_queries(inverted_top_k, input_vectors, index, k)
+    return {
+        'recipes': size,
+        'nnz': int(index.matrix.nnz),
+        'linear_kernel_p50_ms': dense_p50,
+        'linear_kernel_p99_ms': dense_p99,
+        'inverted_p50_ms': inverted_p50,
+        'inverted_p99_ms': inverted_p99,
+        'speedup_p50': dense_p50 / inverted_p50,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark linear_kernel against the inverted-index scorer.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[6000, 60000, 250000, 1000000])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--vocab-size', type=int, default=2000)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = []
+    print('%10s %12s %12s %12s %9s' % ('recipes', 'dense p50', 'inverted p50', 'inverted p99', 'speedup'))
+    for size in args.sizes:
+        result = run(size, args.queries, args.vocab_size, args.k)
+        results.append(result)
+        print('%10d %10.2fms %10.2fms %10.2fms %8.1fx' % (
+            size, result['linear_kernel_p50_ms'], result['inverted_p50_ms'],
+            result['inverted_p99_ms'], result['speedup_p50']))
+
+    if args.output:
+        save_results(args.output, 'inverted_index', args, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import (Column, DateTime, Index, Integer, MetaData, Table, UniqueConstraint, create_engine,
+                        select)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+import likes
+from benchmarks.harness import save_results
+
+# Likes/sec against SQLite for the three ways of writing a like:
+#   python -m benchmarks.bench_likes --likes 5000 --threads 8
+
+metadata = MetaData()
+
+# Same shape as app.LikedRecipe
+liked_recipe = Table(
+    'liked_recipe', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, nullable=False),
+    Column('recipe_id', Integer, nullable=False),
+    Column('created_at', DateTime, nullable=False),
+    Index('ix_liked_recipe_user_created', 'user_id', 'created_at'),
+    UniqueConstraint('user_id', 'recipe_id', name='uq_liked_recipe_user_recipe'),
+)
+
+
+def workload(n_likes, n_users, n_recipes, seed=0):
+    # Roughly one in ten likes repeats an earlier (user, recipe) pair
+    rng = random.Random(seed)
+    pairs = [(rng.randrange(n_users), rng.randrange(n_recipes)) for _ in range(n_likes)]
+    for i in range(0, n_likes, 10):
+        pairs[i] = pairs[rng.randrange(max(i, 1))]
+    return pairs
+
+
+def select_then_insert(Session, user_id, recipe_id):
+    # What like_recipe used to do: SELECT, INSERT, commit. Returns 1 when two
+    # concurrent likes both passed the SELECT and the second INSERT failed.
+    with Session() as session:
+        exists = session.execute(select(liked_recipe.c.id).where(
+            liked_recipe.c.user_id == user_id, liked_recipe.c.recipe_id == recipe_id)).first()
+        if exists is None:
+            try:
+                session.execute(liked_recipe.insert().values(user_id=user_id, recipe_id=recipe_id,
+                                                             created_at=datetime.utcnow()))
+                session.commit()
+            except IntegrityError:
+                return 1
+    return 0
+
+
+def insert_ignore(Session, user_id, recipe_id):
+    with Session() as session:
+        likes.insert_likes(session, liked_recipe,
+                           [{'user_id': user_id, 'recipe_id': recipe_id, 'created_at': datetime.utcnow()}])
+        session.commit()
+    return 0
+
+
+def run(strategy, pairs, threads):
+    path = os.path.join(tempfile.mkdtemp(), 'likes.db')
+    engine = create_engine('sqlite:///' + path, connect_args={'timeout': 30})
+    metadata.create_all(engine)
+    Session = sessionmaker(engine)
+
+    buffer = None
+    if strategy == 'buffered':
+        def write(rows):
+            with Session() as session:
+                likes.insert_likes(session, liked_recipe, rows)
+                session.commit()
+        buffer = likes.LikeBuffer(write)
+        like = lambda user_id, recipe_id: buffer.add(user_id, recipe_id, datetime.utcnow()) or 0
+    else:
+        func = select_then_insert if strategy == 'select_then_insert' else insert_ignore
+        like = lambda user_id, recipe_id: func(Session, user_id, recipe_id)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        races = sum(pool.map(lambda pair: like(*pair), pairs))
+    if buffer is not None:
+        buffer.close()
+    elapsed = time.perf_counter() - start
+
+    with engine.connect() as conn:
+        stored = conn.execute(select(liked_recipe.c.id)).fetchall()
+    engine.dispose()
+    return {'strategy': strategy, 'likes': len(pairs), 'stored': len(stored), 'races': races,
+            'seconds': elapsed, 'likes_per_sec': len(pairs) / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark like writes against SQLite.')
+    parser.add_argument('--likes', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--recipes', type=int, default=6000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    pairs = workload(args.likes, args.users, args.recipes)
+    results = []
+    for strategy in ('select_then_insert', 'insert_ignore', 'buffered'):
+        result = run(strategy, pairs, args.threads)
+        results.append(result)
+        print('%-20s %9.0f likes/s  (%d rows stored, %d failed duplicate inserts)'
+              % (strategy, result['likes_per_sec'], result['stored'], result['races']))
+
+    if args.output:
+        save_results(args.output, 'likes', args, results)
+
+
+if __name__ == '__main__':
+    main()
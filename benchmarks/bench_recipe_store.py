@@ -0,0 +1,115 @@
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.harness import memory_usage, save_results
+from benchmarks.synthetic import generate_recipes
+from recipe_store import RecipeStore
+
+# Compare materializing recommended rows with DataFrame.iloc against the
+# memory-mapped columnar store, for per-request latency and per-worker memory:
+#   python -m benchmarks.bench_recipe_store --sizes 100000 1000000
+
+FIELDS = ['name', 'ingredients', 'steps', 'url']
+
+
+def pandas_rows(recipes, ids, scores):
+    # What the recommendation path did before: iloc, copy, add columns, to_dict
+    rows = recipes.iloc[ids].copy()
+    rows['recipe_id'] = ids
+    rows['score'] = scores
+    return [[record[field] for field in FIELDS] for record in rows.to_dict('records')]
+
+
+def store_rows(store, ids, scores):
+    rows = []
+    for recipe_id, score in zip(ids, scores):
+        recipe = store[recipe_id]
+        recipe.score = score
+        rows.append([recipe[field] for field in FIELDS])
+    return rows
+
+
+def load(kind, directory):
+    if kind == 'pandas':
+        return pd.read_csv(os.path.join(directory, 'recipes.csv'))
+    return RecipeStore.load(directory)
+
+
+def serve(kind, directory, n_requests, k):
+    # Runs in a fresh process: load the catalogue like a worker does, then serve requests
+    baseline_anonymous, baseline_rss = memory_usage()
+    recipes = load(kind, directory)
+    rows = pandas_rows if kind == 'pandas' else store_rows
+
+    rng = np.random.default_rng(1)
+    timings = []
+    for _ in range(n_requests):
+        ids = rng.choice(len(recipes), size=k, replace=False).tolist()
+        scores = rng.random(k).tolist()
+        start = time.perf_counter()
+        rows(recipes, ids, scores)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    anonymous, rss = memory_usage()
+    return {
+        'p50_ms': float(np.percentile(timings, 50)),
+        'p99_ms': float(np.percentile(timings, 99)),
+        'anonymous_mb': anonymous - baseline_anonymous,
+        'rss_mb': rss - baseline_rss,
+    }
+
+
+def run(size, n_requests, k, steps_length):
+    recipes = generate_recipes(size)
+    # Real recipe steps are paragraphs, not one sentence
+    recipes['steps'] = recipes['steps'].str.pad(steps_length, side='right', fillchar='.')
+
+    with tempfile.TemporaryDirectory() as directory:
+        recipes.to_csv(os.path.join(directory, 'recipes.csv'), index=False)
+        store = RecipeStore.from_frame(recipes)
+        store.save(directory)
+
+        loaded = RecipeStore.load(directory)
+        ids = list(range(0, size, max(size // 100, 1)))
+        assert pandas_rows(recipes, ids, [0.0] * len(ids)) == store_rows(loaded, ids, [0.0] * len(ids))
+        del recipes, store, loaded
+
+        context = multiprocessing.get_context('spawn')
+        result = {'recipes': size}
+        for kind in ('pandas', 'store'):
+            with context.Pool(1) as pool:
+                stats = pool.apply(serve, (kind, directory, n_requests, k))
+            result.update({'%s_%s' % (kind, name): value for name, value in stats.items()})
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark DataFrame.iloc rows against the columnar recipe store.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 500000])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--steps-length', type=int, default=1000, help='Characters of steps text per recipe')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = []
+    print('%10s %12s %12s %14s %14s' % ('recipes', 'iloc p50', 'store p50', 'pandas heap', 'store heap'))
+    for size in args.sizes:
+        result = run(size, args.requests, args.k, args.steps_length)
+        results.append(result)
+        print('%10d %10.3fms %10.3fms %12.1fMB %12.1fMB' % (
+            size, result['pandas_p50_ms'], result['store_p50_ms'],
+            result['pandas_anonymous_mb'], result['store_anonymous_mb']))
+
+    if args.output:
+        save_results(args.output, 'recipe_store', args, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import argparse
+import multiprocessing
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from benchmarks.harness import build_catalogue, import_app, memory_usage, percentiles, save_results
+from benchmarks.synthetic import generate_queries
+
+# Scoring throughput of concurrent request threads, in-thread (0 processes) against
+# the scoring pool with micro-batching, plus the memory the pool processes add:
+#   python -m benchmarks.bench_scoring --recipes 200000 --processes 0 2 4 --concurrency 16
+
+
+def measure(directory, csv_path, index_dir, processes, concurrency, n_queries, vocab_size):
+    # Runs in a fresh process per configuration, since app reads its config at import
+    app = import_app(directory, csv_path, index_dir, SCORING_PROCESSES=str(processes))
+    app.start_background_tasks()
+    app.load_recommender()
+    if app.scoring_pool is not None:
+        app.scoring_pool.start()
+
+    snapshot = app.catalogue.snapshot
+    vectors = [snapshot.vectorizer.transform([' '.join(query)])
+               for query in generate_queries(n_queries, vocab_size=vocab_size)]
+
+    def one_query(input_vector):
+        start = time.perf_counter()
+        app.score_query(snapshot, input_vector)
+        return time.perf_counter() - start
+
+    # Warm up the pool processes' mappings of the index
+    for input_vector in vectors[:processes * 4]:
+        app.score_query(snapshot, input_vector)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as threads:
+        timings = list(threads.map(one_query, vectors))
+    elapsed = time.perf_counter() - start
+
+    result = {'processes': processes, 'queries_per_s': len(vectors) / elapsed}
+    result.update(percentiles(timings))
+    if app.scoring_pool is not None:
+        pids = list(app.scoring_pool.executor._processes)
+        result['pool_anonymous_mb'] = sum(memory_usage(pid)[0] for pid in pids)
+        result['pool_rss_mb'] = sum(memory_usage(pid)[1] for pid in pids)
+        app.scoring_pool.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark scoring in-thread against the scoring process pool.')
+    parser.add_argument('--recipes', type=int, default=100000)
+    parser.add_argument('--vocab-size', type=int, default=2000)
+    parser.add_argument('--processes', type=int, nargs='+', default=[0, 2, 4])
+    parser.add_argument('--concurrency', type=int, default=16, help='Request threads submitting queries')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = []
+    print('%10s %12s %10s %10s %10s' % ('processes', 'queries/s', 'p50', 'p99', 'pool heap'))
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directory:
+        csv_path, index_dir, _ = build_catalogue(directory, args.recipes, args.vocab_size)
+        for processes in args.processes:
+            # Not a multiprocessing.Pool: its daemonic workers cannot start the scoring pool
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as runner:
+                result = runner.submit(measure, directory, csv_path, index_dir, processes, args.concurrency,
+                                       args.queries, args.vocab_size).result()
+            result['recipes'] = args.recipes
+            results.append(result)
+            print('%10d %12.0f %8.2fms %8.2fms %8.1fMB' % (
+                processes, result['queries_per_s'], result['p50_ms'], result['p99_ms'],
+                result.get('pool_anonymous_mb', 0.0)))
+
+    if args.output:
+        save_results(args.output, 'scoring', args, results)
+
+
+if __name__ == '__main__':
+    main()
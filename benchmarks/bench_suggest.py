@@ -0,0 +1,115 @@
+import argparse
+import random
+import time
+
+import numpy as np
+import pandas as pd
+
+import recipe_index
+import suggest
+from benchmarks.harness import percentiles, save_results
+from benchmarks.synthetic import ingredient_vocabulary
+
+# Latency of ingredient autocomplete: prefix completions, and typos that fall back
+# to the symmetric-delete correction, alone or after other words of an ingredient:
+#   python -m benchmarks.bench_suggest --terms 5000 20000
+#   python -m benchmarks.bench_suggest --csv recipes1.csv
+# Synthetic terms are built from 16 syllables, so they are much closer to each
+# other than real ingredient names and typos have many near matches: a worst case.
+
+
+def synthetic_suggester(size, seed=0):
+    # Zipf-like term frequencies, as in the synthetic catalogues, in random order
+    frequencies = (1e6 / np.arange(1, size + 1)).astype(np.int64)
+    return suggest.IngredientSuggester(ingredient_vocabulary(size, seed),
+                                       np.random.default_rng(seed).permutation(frequencies))
+
+
+def misspell(term, rng):
+    # One random deletion, insertion, substitution or swap of neighbouring letters
+    position = rng.randrange(len(term))
+    letter = rng.choice('abcdefghijklmnopqrstuvwxyz')
+    kind = rng.randrange(4) if len(term) > 1 else 1
+    if kind == 0:
+        return term[:position] + term[position + 1:]
+    if kind == 1:
+        return term[:position] + letter + term[position:]
+    if kind == 2:
+        return term[:position] + letter + term[position + 1:]
+    position = min(position, len(term) - 2)
+    return term[:position] + term[position + 1] + term[position] + term[position + 2:]
+
+
+def make_queries(suggester, n_queries, seed=1):
+    # {kind: [(query, intended term or None)]}; typos that happen to be a prefix of
+    # some term are completed rather than corrected, so they are left out
+    rng = random.Random(seed)
+    terms = [term for term in suggester.terms if len(term) > 2]
+    queries = {'prefix': [], 'typo': [], 'multi_word_typo': []}
+    while min(len(kind) for kind in queries.values()) < n_queries:
+        term = rng.choice(terms)
+        queries['prefix'].append((term[:rng.randint(1, min(4, len(term)))], None))
+        typo = misspell(term, rng)
+        if not suggester.complete(typo, 1):
+            queries['typo'].append((typo, term))
+            queries['multi_word_typo'].append(('onion, %s %s' % (rng.choice(terms), typo), term))
+    return {kind: items[:n_queries] for kind, items in queries.items()}
+
+
+def measure(suggester, queries, limit):
+    timings, found = [], 0
+    for query, intended in queries:
+        start = time.perf_counter()
+        suggestions = suggester.suggest(query, limit)
+        timings.append(time.perf_counter() - start)
+        found += intended is not None and any(
+            suggestion['ingredient'].split()[-1] == intended for suggestion in suggestions)
+    result = percentiles(timings)
+    if queries[0][1] is not None:
+        # Share of typos whose intended term was suggested
+        result['recall'] = found / len(queries)
+    return result
+
+
+def run(name, suggester, build_s, n_queries, limit):
+    results = []
+    for kind, queries in make_queries(suggester, n_queries).items():
+        result = {'terms': len(suggester.terms), 'vocabulary': name, 'strategy': kind, 'build_s': build_s}
+        result.update(measure(suggester, queries, limit))
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ingredient autocomplete and typo correction.')
+    parser.add_argument('--terms', type=int, nargs='+', default=[5000, 20000])
+    parser.add_argument('--csv', help='Use the vocabulary of this recipes CSV instead of synthetic terms')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = []
+    print('%10s %-16s %10s %10s %10s %8s' % ('terms', 'strategy', 'p50', 'p99', 'build', 'recall'))
+    if args.csv:
+        index = recipe_index.fit_index(pd.read_csv(args.csv))
+        vocabularies = [('csv', lambda: suggest.IngredientSuggester.from_index(index))]
+    else:
+        vocabularies = [('synthetic', lambda size=size: synthetic_suggester(size)) for size in args.terms]
+
+    for name, build in vocabularies:
+        start = time.perf_counter()
+        suggester = build()
+        build_s = time.perf_counter() - start
+        for result in run(name, suggester, build_s, args.queries, args.limit):
+            results.append(result)
+            print('%10d %-16s %8.3fms %8.3fms %9.2fs %8s' % (
+                result['terms'], result['strategy'], result['p50_ms'], result['p99_ms'], result['build_s'],
+                '%.3f' % result['recall'] if 'recall' in result else '-'))
+
+    if args.output:
+        save_results(args.output, 'suggest', args, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.harness import build_catalogue, save_results
+
+# Import-time budget for app.py. Importing the app must stay cheap and must not
+# load the recipe index or the heavy libraries; those come later, from
+# load_recommender(). Each measurement runs in a fresh interpreter:
+#   python -m benchmarks.check_startup --budget 1.5
+# The gunicorn hooks in gunicorn.conf.py are then called the way the master and a
+# worker call them. Exits with status 1 when the import is over budget, pulls in a
+# forbidden module, or a hook fails.
+
+FORBIDDEN_MODULES = ('sklearn', 'pandas', 'gtts')
+
+MEASURE = '''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter() - start
+loaded_at_import = app.catalogue.loaded
+forbidden = [name for name in %r if name in sys.modules]
+start = time.perf_counter()
+app.load_recommender()
+warmed = time.perf_counter() - start
+print(json.dumps({'import_s': imported, 'warm_s': warmed, 'loaded_at_import': loaded_at_import,
+                  'forbidden_modules': forbidden}))
+''' % (FORBIDDEN_MODULES,)
+
+# when_ready in the master, then post_fork in a forked worker
+HOOKS = '''
+import json, logging, os, runpy
+import app
+
+class Server:
+    log = logging.getLogger('gunicorn')
+
+hooks = runpy.run_path(os.path.join(os.path.dirname(app.__file__), 'gunicorn.conf.py'))
+try:
+    hooks['when_ready'](Server())
+    read_end, write_end = os.pipe()
+    if os.fork() == 0:
+        os.close(read_end)
+        try:
+            hooks['post_fork'](Server(), None)
+        except Exception as e:
+            os.write(write_end, ('post_fork failed: %r' % e).encode())
+        os._exit(0)
+    os.close(write_end)
+    with os.fdopen(read_end) as f:
+        error = f.read() or None
+    os.wait()
+except Exception as e:
+    error = 'when_ready failed: %r' % e
+print(json.dumps({'hooks_error': error}))
+'''
+
+
+def run_script(directory, csv_path, index_dir, script):
+    environ = dict(os.environ, RECIPES_CSV=csv_path, RECIPE_INDEX_DIR=index_dir,
+                   DATABASE_URL='sqlite:///' + os.path.join(directory, 'app.db'),
+                   AUDIO_CACHE_DIR=os.path.join(directory, 'audio'),
+                   PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get('PYTHONPATH')])))
+    output = subprocess.run([sys.executable, '-c', script], cwd=directory, env=environ,
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(directory, csv_path, index_dir):
+    return run_script(directory, csv_path, index_dir, MEASURE)
+
+
+def check_hooks(directory, csv_path, index_dir):
+    # The error of the gunicorn hooks, or None
+    return run_script(directory, csv_path, index_dir, HOOKS)['hooks_error']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the import time of app.py against a budget.')
+    parser.add_argument('--budget', type=float, default=1.5, help='Seconds allowed for import app')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters to time; the fastest counts')
+    parser.add_argument('--recipes', type=int, default=10000)
+    parser.add_argument('--vocab-size', type=int, default=2000)
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directory:
+        csv_path, index_dir, _ = build_catalogue(directory, args.recipes, args.vocab_size)
+        runs = [measure(directory, csv_path, index_dir) for _ in range(args.runs)]
+        hooks_error = check_hooks(directory, csv_path, index_dir)
+
+    # The fastest run is the least disturbed by the rest of the machine
+    best = min(runs, key=lambda run: run['import_s'])
+    result = {'recipes': args.recipes, 'import_s': best['import_s'],
+              'warm_s': min(run['warm_s'] for run in runs)}
+    print('import app      %7.3fs (budget %.3fs)' % (result['import_s'], args.budget))
+    print('load_recommender %6.3fs' % result['warm_s'])
+    print('gunicorn hooks   %s' % ('ok' if hooks_error is None else 'failed'))
+
+    failures = []
+    if result['import_s'] > args.budget:
+        failures.append('import app took %.3fs, over the %.3fs budget' % (result['import_s'], args.budget))
+    if any(run['loaded_at_import'] for run in runs):
+        failures.append('the recipe index was loaded at import')
+    forbidden = sorted({name for run in runs for name in run['forbidden_modules']})
+    if forbidden:
+        failures.append('imported at import time: %s' % ', '.join(forbidden))
+    if hooks_error:
+        failures.append('gunicorn hooks: ' + hooks_error)
+    for failure in failures:
+        print('FAIL: ' + failure)
+
+    if args.output:
+        save_results(args.output, 'startup', args, [result])
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
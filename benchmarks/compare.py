@@ -0,0 +1,72 @@
+import argparse
+import json
+import sys
+
+# Compare two results files written with --output, e.g. before and after a change:
+#   python -m benchmarks.compare base.json head.json --threshold 10
+# Exits with status 1 when any metric got worse by more than the threshold.
+
+# Fields that identify a result row rather than measure it
+IDENTITY_FIELDS = ('recipes', 'terms', 'endpoint', 'strategy', 'processes', 'concurrency')
+HIGHER_IS_BETTER = ('_per_s', '_per_sec')
+LOWER_IS_BETTER = ('_ms', '_s', '_mb', '_kb')
+
+
+def direction(metric):
+    # +1 when a larger value is better, -1 when smaller is better, 0 when neither.
+    # A maximum is a single sample, too noisy to compare between runs.
+    if metric.startswith('max_'):
+        return 0
+    if metric.endswith(HIGHER_IS_BETTER) or metric.startswith('speedup'):
+        return 1
+    if metric.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def identity(result):
+    return tuple((field, result[field]) for field in IDENTITY_FIELDS if field in result)
+
+
+def compare(base, head, threshold):
+    base_results = {identity(result): result for result in base['results']}
+    rows = []
+    for result in head['results']:
+        key = identity(result)
+        if key not in base_results:
+            continue
+        for metric, value in result.items():
+            old = base_results[key].get(metric)
+            sign = direction(metric)
+            if not sign or not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+            change = (value - old) / old * 100
+            rows.append((key, metric, old, value, change, -sign * change > threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark results files.')
+    parser.add_argument('base')
+    parser.add_argument('head')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Percent change counted as a regression')
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+    if base['benchmark'] != head['benchmark']:
+        parser.error('Cannot compare %s results with %s results' % (base['benchmark'], head['benchmark']))
+
+    print('%s: %s -> %s' % (head['benchmark'], base.get('commit'), head.get('commit')))
+    rows = compare(base, head, args.threshold)
+    for key, metric, old, new, change, regressed in rows:
+        label = ' '.join('%s=%s' % item for item in key)
+        print('%-28s %-22s %12.3f %12.3f %+8.1f%%%s' % (label, metric, old, new, change,
+                                                        '  REGRESSION' if regressed else ''))
+    sys.exit(1 if any(row[-1] for row in rows) else 0)
+
+
+if __name__ == '__main__':
+    main()
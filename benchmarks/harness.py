@@ -0,0 +1,101 @@
+import importlib
+import json
+import os
+import platform
+import subprocess
+import time
+
+import numpy as np
+
+import recipe_index
+from benchmarks.synthetic import generate_recipes
+
+# Shared pieces of the benchmark scripts: synthetic catalogues on disk, latency
+# percentiles, process memory and JSON results that benchmarks.compare can diff.
+
+
+def build_catalogue(directory, n_recipes, vocab_size=2000, steps_length=0):
+    # Write a synthetic recipes CSV and its index the way a deployment would;
+    # returns (csv_path, index_dir, seconds spent building the index)
+    recipes = generate_recipes(n_recipes, vocab_size=vocab_size)
+    if steps_length:
+        # Real recipe steps are paragraphs, not one sentence
+        recipes['steps'] = recipes['steps'].str.pad(steps_length, side='right', fillchar='.')
+    csv_path = os.path.join(directory, 'recipes.csv')
+    index_dir = os.path.join(directory, 'recipe_index')
+    recipes.to_csv(csv_path, index=False)
+
+    start = time.perf_counter()
+    recipe_index.build_index(csv_path, index_dir)
+    return csv_path, index_dir, time.perf_counter() - start
+
+
+def silent_engine(text, path):
+    open(path, 'wb').close()
+
+
+def import_app(directory, csv_path, index_dir, **environ):
+    # Import app.py against a synthetic catalogue, with SQLite standing in for MySQL.
+    # Must run before anything else imports app; returns the module.
+    os.environ.update({
+        'RECIPES_CSV': csv_path,
+        'RECIPE_INDEX_DIR': index_dir,
+        'DATABASE_URL': 'sqlite:///' + os.path.join(os.path.abspath(directory), 'app.db'),
+        'AUDIO_CACHE_DIR': os.path.join(directory, 'audio_cache'),
+    }, **environ)
+
+    # Background threads only start with the first request, after the tables exist
+    app = importlib.import_module('app')
+    with app.app.app_context():
+        app.db.create_all()
+
+    # Measure the app, not a text-to-speech web service
+    app.app.config['TTS_ENGINE'] = silent_engine
+    return app
+
+
+def percentiles(timings, prefix=''):
+    # Millisecond latency summary of a list of timings in seconds
+    timings = np.asarray(timings) * 1000
+    if not len(timings):
+        return {}
+    return {
+        prefix + 'p50_ms': float(np.percentile(timings, 50)),
+        prefix + 'p95_ms': float(np.percentile(timings, 95)),
+        prefix + 'p99_ms': float(np.percentile(timings, 99)),
+        prefix + 'max_ms': float(timings.max()),
+    }
+
+
+def memory_usage(pid='self'):
+    # Anonymous (heap, never shared between workers) and resident memory in MB (Linux only)
+    fields = {}
+    with open('/proc/%s/smaps_rollup' % pid) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return fields['Anonymous'] / 1024, fields['Rss'] / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(path, benchmark, args, results):
+    # Results plus enough context to tell two runs apart
+    with open(path, 'w') as f:
+        json.dump({
+            'benchmark': benchmark,
+            'commit': git_commit(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'args': vars(args),
+            'results': results,
+        }, f, indent=2)
@@ -0,0 +1,198 @@
+import argparse
+import http.cookiejar
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from benchmarks.harness import build_catalogue, import_app, percentiles, save_results
+from benchmarks.synthetic import generate_queries
+
+# Load test of the Flask app on a synthetic catalogue with SQLite standing in for
+# MySQL. Logged-in clients send a mix of /recommendation, /like_recipe and
+# /dashboard requests, either through the Flask test client or over HTTP to a
+# local threaded WSGI server:
+#   python -m benchmarks.load_test --recipes 100000 --requests 5000 --concurrency 8 --server wsgi
+
+DEFAULT_MIX = 'recommendation=70,like=20,dashboard=10'
+
+
+class TestClientSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        return self.client.open(path, method=method, data=data).status_code
+
+
+class HTTPSession:
+    # One cookie jar per simulated user, like a browser
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(urllib.request.Request(self.base_url + path, data=body, method=method)) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(','):
+        name, weight = item.split('=')
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def seed_database(app, n_users, likes_per_user, n_recipes):
+    # Users log in as user<i>/password; each starts with a few likes so the
+    # dashboard and the hybrid ranking have something to do
+    rng = random.Random(0)
+    with app.app.app_context():
+        users = [app.SignUp(name='User %d' % i, phone='0', email='user%d@example.com' % i,
+                            username='user%d' % i, password='password') for i in range(n_users)]
+        app.db.session.add_all(users)
+        app.db.session.flush()
+        rows = [{'user_id': user.id, 'recipe_id': recipe_id, 'created_at': datetime.utcnow()}
+                for user in users for recipe_id in rng.sample(range(n_recipes), likes_per_user)]
+        if rows:
+            app.likes.insert_likes(app.db.session, app.LikedRecipe.__table__, rows)
+        app.db.session.commit()
+    app.sync_collaborative()
+
+
+def run_load(app, make_session, args, queries, n_recipes):
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    local = threading.local()
+    rng_lock = threading.Lock()
+    rng = random.Random(1)
+
+    def session():
+        # Each worker thread is one logged-in user
+        if not hasattr(local, 'session'):
+            local.session = make_session()
+            with rng_lock:
+                user = rng.randrange(args.users)
+            local.session.request('POST', '/login', {'username': 'user%d' % user, 'password': 'password'})
+        return local.session
+
+    def one_request(_):
+        with rng_lock:
+            name = rng.choices(names, weights)[0]
+            # A share of traffic can all ask for the same query, like a promoted ingredient
+            query = queries[0] if rng.random() < args.hot_share else queries[rng.randrange(len(queries))]
+            recipe_id = rng.randrange(n_recipes)
+        if name == 'recommendation':
+            method, path = 'GET', '/recommendation?' + urllib.parse.urlencode(
+                {'ingredients': ','.join(query), 'k': args.k})
+        elif name == 'like':
+            method, path = 'POST', '/like_recipe/%d' % recipe_id
+        else:
+            method, path = 'GET', '/dashboard'
+
+        client = session()
+        start = time.perf_counter()
+        status = client.request(method, path)
+        return name, status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        outcomes = list(pool.map(one_request, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    by_endpoint = defaultdict(list)
+    for outcome in outcomes:
+        by_endpoint[outcome[0]].append(outcome)
+
+    results = []
+    for name, endpoint_outcomes in sorted(by_endpoint.items()):
+        statuses = defaultdict(int)
+        for _, status, _ in endpoint_outcomes:
+            statuses[str(status)] += 1
+        result = {
+            'endpoint': name,
+            'requests': len(endpoint_outcomes),
+            'errors': sum(count for status, count in statuses.items() if int(status) >= 500),
+            'statuses': dict(statuses),
+        }
+        result.update(percentiles([seconds for _, _, seconds in endpoint_outcomes]))
+        results.append(result)
+
+    total = {'endpoint': 'all', 'requests': len(outcomes), 'seconds': elapsed,
+             'requests_per_s': len(outcomes) / elapsed,
+             'errors': sum(result['errors'] for result in results)}
+    total.update(percentiles([seconds for _, _, seconds in outcomes]))
+    return results + [total]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test /recommendation, /like_recipe and /dashboard.')
+    parser.add_argument('--recipes', type=int, default=20000)
+    parser.add_argument('--vocab-size', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--likes-per-user', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=500, help='Distinct ingredient queries to draw from')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('-k', type=int, default=5)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Relative weights, e.g. %s' % DEFAULT_MIX)
+    parser.add_argument('--hot-share', type=float, default=0.0,
+                        help='Share of /recommendation requests sending one identical query')
+    parser.add_argument('--server', choices=['test-client', 'wsgi'], default='test-client')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directory:
+        csv_path, index_dir, _ = build_catalogue(directory, args.recipes, args.vocab_size)
+        app = import_app(directory, csv_path, index_dir)
+        seed_database(app, args.users, args.likes_per_user, args.recipes)
+        queries = generate_queries(args.queries, vocab_size=args.vocab_size)
+
+        server = None
+        if args.server == 'wsgi':
+            from werkzeug.serving import WSGIRequestHandler, make_server
+
+            class QuietHandler(WSGIRequestHandler):
+                def log_request(self, *args, **kwargs):
+                    pass
+
+            server = make_server('127.0.0.1', 0, app.app, threaded=True, request_handler=QuietHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = 'http://127.0.0.1:%d' % server.server_port
+            make_session = lambda: HTTPSession(base_url)
+        else:
+            make_session = lambda: TestClientSession(app.app)
+
+        try:
+            results = run_load(app, make_session, args, queries, args.recipes)
+        finally:
+            if server is not None:
+                server.shutdown()
+
+        print('%-15s %9s %7s %10s %10s %10s' % ('endpoint', 'requests', 'errors', 'p50', 'p95', 'p99'))
+        for result in results:
+            print('%-15s %9d %7d %8.2fms %8.2fms %8.2fms' % (
+                result['endpoint'], result['requests'], result['errors'],
+                result['p50_ms'], result['p95_ms'], result['p99_ms']))
+        print('%.0f requests/s' % results[-1]['requests_per_s'])
+        results[-1]['coalesced'] = app.recommendation_flight.coalesced
+        print('%d identical recommendation queries coalesced' % results[-1]['coalesced'])
+
+        if args.output:
+            save_results(args.output, 'load_test', args, results)
+
+
+if __name__ == '__main__':
+    main()
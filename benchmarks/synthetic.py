@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+SYLLABLES = ['ka', 'ma', 'la', 'pa', 'ne', 'ri', 'go', 'to', 'mi', 'sa', 'ji', 'ra', 'du', 'be', 'ch', 'sh']
+
+
+def ingredient_vocabulary(vocab_size, seed=0):
+    # Pronounceable, unique single-token ingredient names such as "kamari"
+    rng = np.random.default_rng(seed)
+    names = set()
+    while len(names) < vocab_size:
+        parts = rng.choice(SYLLABLES, size=rng.integers(2, 5))
+        names.add(''.join(parts))
+    return sorted(names)
+
+
+def generate_recipes(n_recipes, vocab_size=2000, min_ingredients=3, max_ingredients=15, seed=0):
+    # Synthetic catalogue with the same columns as recipes1.csv. Ingredient
+    # popularity follows a Zipf-like curve so a few staples (salt, oil...) appear
+    # in most recipes and the long tail in very few, like the real data.
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(ingredient_vocabulary(vocab_size, seed))
+    popularity = 1.0 / np.arange(1, vocab_size + 1)
+    popularity /= popularity.sum()
+
+    counts = rng.integers(min_ingredients, max_ingredients + 1, size=n_recipes)
+    drawn = vocabulary[rng.choice(vocab_size, size=counts.sum(), p=popularity)]
+    bounds = np.cumsum(counts)[:-1]
+    ingredients = [', '.join(items) for items in np.split(drawn, bounds)]
+
+    ids = np.arange(n_recipes)
+    return pd.DataFrame({
+        'name': ['Recipe %d' % i for i in ids],
+        'ingredients': ingredients,
+        'steps': ['Combine ' + text + ' and cook until done.' for text in ingredients],
+        'url': ['https://example.com/recipes/%d' % i for i in ids],
+        'totalingredients': counts,
+    })
+
+
+def generate_queries(n_queries, vocab_size=2000, min_terms=3, max_terms=6, seed=1):
+    # Pantry-style queries drawn with the same popularity skew as the catalogue
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array(ingredient_vocabulary(vocab_size))
+    popularity = 1.0 / np.arange(1, vocab_size + 1)
+    popularity /= popularity.sum()
+    return [list(vocabulary[rng.choice(vocab_size, size=rng.integers(min_terms, max_terms + 1), p=popularity)])
+            for _ in range(n_queries)]
@@ -0,0 +1,430 @@
+import argparse
+import copy
+import io
+import json
+import logging
+import math
+import numbers
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+from scipy.sparse import csr_matrix, hstack, vstack
+
+import embeddings
+import query_cache
+import recipe_index
+import recipe_store
+import recommender
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+RECIPE_COLUMNS = recipe_store.COLUMNS
+
+# Recipes appended since the last full fit live next to the index they extend
+DELTA_FILE = 'delta.csv'
+DELTA_META_FILE = 'delta.json'
+DELTA_LOCK = 'delta.lock'
+COMPACT_LOCK = 'compact.lock'
+
+# Refit once the delta reaches this share of the catalogue, or once this share of
+# the catalogue has ingredient terms missing from the fitted vocabulary
+COMPACT_DELTA_RATIO = 0.1
+COMPACT_UNSEEN_RATIO = 0.01
+
+
+class NoIndexError(RuntimeError):
+    # Raised by ingest when the catalogue was fitted in-process: there is no index
+    # directory to keep a delta in
+    pass
+
+
+@contextmanager
+def file_lock(path, blocking=True):
+    # Cross-process lock shared by every worker using the same index directory
+    with open(path, 'a') as f:
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_delta_meta(version_dir):
+    # Rows in delta.csv and the byte size they take up. Written after each append, so
+    # readers only ever see whole rows, and never have to parse the CSV to count them.
+    try:
+        with open(os.path.join(version_dir, DELTA_META_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'rows': 0, 'bytes': 0}
+
+
+def read_delta(version_dir, start=0, end=None):
+    # The delta recipes between two byte offsets recorded in delta.json, so a
+    # refresh only parses the rows appended since the last one
+    import pandas as pd
+    if end is None:
+        end = read_delta_meta(version_dir)['bytes']
+    if end <= start:
+        return pd.DataFrame(columns=RECIPE_COLUMNS)
+    with open(os.path.join(version_dir, DELTA_FILE), 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return pd.read_csv(io.BytesIO(data), header=0 if start == 0 else None, names=RECIPE_COLUMNS,
+                       dtype={column: str for column in recipe_store.STRING_COLUMNS})
+
+
+def append_delta(version_dir, new_recipes):
+    # Call with DELTA_LOCK held; returns the number of delta rows before these
+    meta = read_delta_meta(version_dir)
+    data = new_recipes[RECIPE_COLUMNS].to_csv(header=meta['bytes'] == 0, index=False).encode('utf-8')
+    with open(os.path.join(version_dir, DELTA_FILE), 'ab') as f:
+        # Drop whatever an interrupted append left after the recorded rows
+        f.truncate(meta['bytes'])
+        f.write(data)
+
+    path = os.path.join(version_dir, DELTA_META_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'rows': meta['rows'] + len(new_recipes), 'bytes': meta['bytes'] + len(data)}, f)
+    os.replace(path + '.tmp', path)
+    return meta['rows']
+
+
+def count_unseen_terms(vectorizer, recipes):
+    # Ingredient terms the vocabulary can't represent, with their document counts,
+    # and the number of recipes having any
+    analyzer = vectorizer.build_analyzer()
+    vocabulary = vectorizer.vocabulary_
+    unseen = Counter()
+    n_recipes = 0
+    for text in recipe_index.prepare_ingredients(recipes):
+        terms = {term for term in analyzer(text) if term not in vocabulary}
+        unseen.update(terms)
+        n_recipes += bool(terms)
+    return unseen, n_recipes
+
+
+def _missing(value):
+    # JSON null, or NaN for an empty cell of a recipes CSV
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def prepare_recipes(records):
+    # New recipes as a frame of RECIPE_COLUMNS. Raises ValueError unless every record
+    # is an object with string name and ingredients, optional string steps and url,
+    # and an optional numeric totalingredients.
+    import pandas as pd
+    prepared = []
+    for position, record in enumerate(records):
+        if not isinstance(record, dict):
+            raise ValueError('Recipe %d is not an object' % position)
+        missing = {'name', 'ingredients'} - {column for column, value in record.items() if not _missing(value)}
+        if missing:
+            raise ValueError('Recipe %d is missing required fields: %s' % (position, ', '.join(sorted(missing))))
+
+        recipe = {}
+        for column in recipe_store.STRING_COLUMNS:
+            value = record.get(column)
+            value = '' if _missing(value) else value
+            if not isinstance(value, str):
+                raise ValueError('Recipe %d: %s must be a string' % (position, column))
+            recipe[column] = value
+
+        count = record.get('totalingredients')
+        if _missing(count):
+            count = len(recipe['ingredients'].split(','))
+        elif isinstance(count, bool) or not isinstance(count, numbers.Real):
+            raise ValueError('Recipe %d: totalingredients must be a number' % position)
+        recipe['totalingredients'] = count
+        prepared.append(recipe)
+    return pd.DataFrame(prepared, columns=RECIPE_COLUMNS)
+
+
+class Snapshot:
+    # Immutable view of the catalogue: the fitted base index plus a delta segment of
+    # recipes appended since, vectorized with the base vocabulary and IDF. Requests
+    # read the current snapshot once and use it throughout, so a swap never changes
+    # the data under a running request.
+
+    def __init__(self, index):
+        # The base index alone; appended recipes are added with extend()
+        self.index = index
+        self.vectorizer = index.vectorizer
+        self.n_base = index.matrix.shape[0]
+
+        # Recipe ids are positions in self.recipes: the base recipes, then the delta
+        self.recipes = index.store
+        self.n_delta = 0
+        # Bytes of delta.csv covered by this snapshot
+        self.delta_bytes = 0
+        self.delta_matrix = csr_matrix((0, index.matrix.shape[1]))
+        self.delta_postings = recipe_index.build_postings(self.delta_matrix)
+        self.unseen_terms, self.unseen_recipes = Counter(), 0
+
+        # Dense embeddings, when built for this index version (see embeddings.py)
+        self.dense = embeddings.load(index.path) if index.path is not None else None
+
+        # Attribute index for filtered queries, and the masks built from it (see filters.py)
+        self.total_ingredients = self.recipes.column('totalingredients')
+        self.filter_masks = query_cache.LRUCache(maxsize=128, ttl=float('inf'))
+
+    def extend(self, new_recipes, delta_bytes):
+        # A new snapshot with new_recipes appended to the delta. Only the new rows are
+        # vectorized; the delta rows, postings and store are carried over from this one.
+        new_matrix = self.vectorizer.transform(recipe_index.prepare_ingredients(new_recipes))
+        new_store = recipe_store.RecipeStore.from_frame(new_recipes)
+        unseen_terms, unseen_recipes = count_unseen_terms(self.vectorizer, new_recipes)
+
+        snapshot = copy.copy(self)
+        stores = self.recipes.stores if self.n_delta else [self.recipes]
+        snapshot.recipes = recipe_store.ChainedStore(stores + [new_store])
+        snapshot.n_delta = self.n_delta + len(new_recipes)
+        snapshot.delta_bytes = delta_bytes
+        snapshot.delta_matrix = vstack([self.delta_matrix, new_matrix], format='csr')
+        snapshot.delta_postings = hstack([self.delta_postings, recipe_index.build_postings(new_matrix)], format='csr')
+        snapshot.unseen_terms = self.unseen_terms + unseen_terms
+        snapshot.unseen_recipes = self.unseen_recipes + unseen_recipes
+        if self.dense is not None:
+            snapshot.dense = self.dense.extend(new_matrix)
+        snapshot.total_ingredients = np.concatenate([self.total_ingredients, new_store.column('totalingredients')])
+        snapshot.filter_masks = query_cache.LRUCache(maxsize=128, ttl=float('inf'))
+        return snapshot
+
+    def __len__(self):
+        return self.n_base + self.n_delta
+
+    @property
+    def version(self):
+        return '%s+%d' % (self.index.version, self.n_delta)
+
+    @property
+    def drift(self):
+        # >= 1 once either compaction threshold has been crossed
+        delta_ratio = self.n_delta / max(self.n_base, 1)
+        unseen_ratio = self.unseen_recipes / max(self.n_base, 1)
+        return max(delta_ratio / COMPACT_DELTA_RATIO, unseen_ratio / COMPACT_UNSEEN_RATIO)
+
+    def recipes_with_term(self, term):
+        # Sorted ids of every recipe containing the term: its base and delta posting lists
+        column = self.vectorizer.vocabulary_.get(term)
+        if column is None:
+            return np.empty(0, dtype=np.int64)
+        base = self.index.postings
+        delta = self.delta_postings
+        return np.concatenate([base.indices[base.indptr[column]:base.indptr[column + 1]],
+                               delta.indices[delta.indptr[column]:delta.indptr[column + 1]] + self.n_base])
+
+    def recipe_terms(self, recipe_id):
+        # Term ids and TF-IDF weights of one recipe's row, base or delta
+        if recipe_id < self.n_base:
+            matrix, row = self.index.matrix, recipe_id
+        else:
+            matrix, row = self.delta_matrix, recipe_id - self.n_base
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        return matrix.indices[start:end], matrix.data[start:end]
+
+    def lookup(self, recipe_ids):
+        # Row views of many recipes at once; unknown ids are left out
+        return {recipe_id: self.recipes[recipe_id] for recipe_id in recipe_ids if 0 <= recipe_id < len(self)}
+
+    def score(self, input_vectors):
+        # Cosine scores of each query row over base and delta recipes; delta ids follow the base ids
+        return recommender.score_segments(input_vectors, [self.index.postings, self.delta_postings])
+
+
+class Catalogue:
+    # Holds the current snapshot for this worker. Only writers (ingest, refresh,
+    # compaction) take locks; readers just read the .snapshot attribute. Nothing is
+    # loaded until the snapshot is first needed (or refresh() is called), so
+    # creating a Catalogue at import time is free.
+
+    def __init__(self, csv_path=recipe_index.DEFAULT_CSV, index_dir=recipe_index.DEFAULT_INDEX_DIR):
+        self.csv_path = csv_path
+        self.index_dir = index_dir
+        self.on_swap = []
+        self._lock = threading.Lock()
+        self._compacting = threading.Lock()
+        self._state = None
+        self._snapshot = None
+
+    @property
+    def loaded(self):
+        return self._snapshot is not None
+
+    @property
+    def snapshot(self):
+        if self._snapshot is None:
+            self.refresh()
+        return self._snapshot
+
+    def _disk_state(self):
+        try:
+            version_dir = recipe_index.current_version(self.index_dir)
+        except OSError:
+            return None
+        meta = read_delta_meta(version_dir)
+        return version_dir, meta['rows'], meta['bytes']
+
+    def refresh(self):
+        # Swap in a new snapshot if another worker published an index or appended recipes
+        with self._lock:
+            state = self._disk_state()
+            if self._snapshot is not None and state == self._state:
+                return False
+
+            current = self._snapshot
+            if current is not None and state is not None and current.index.path == state[0]:
+                # Same base index: only recipes were appended
+                snapshot = current
+            else:
+                try:
+                    index = recipe_index.load_index(self.index_dir, csv_path=self.csv_path)
+                except (OSError, recipe_index.StaleIndexError) as e:
+                    if current is not None:
+                        # Mid-compaction or a bad build: keep serving what we have
+                        logger.warning('Not refreshing recipe index (%s)', e)
+                        return False
+                    logger.warning('Recipe index unavailable (%s), fitting in-process', e)
+                    import pandas as pd
+                    index = recipe_index.fit_index(pd.read_csv(self.csv_path),
+                                                   csv_sha256=recipe_index.file_hash(self.csv_path))
+                    state = None
+                snapshot = Snapshot(index)
+                if index.path is not None:
+                    # The version loaded, which may be newer than the state read above
+                    meta = read_delta_meta(index.path)
+                    state = index.path, meta['rows'], meta['bytes']
+
+            if state is not None and state[2] > snapshot.delta_bytes:
+                snapshot = snapshot.extend(read_delta(snapshot.index.path, snapshot.delta_bytes, state[2]), state[2])
+            self._snapshot = snapshot
+            self._state = state
+
+        for callback in self.on_swap:
+            callback(self._snapshot)
+        return True
+
+    def ingest(self, records, auto_compact=True):
+        # Append recipes using the existing vocabulary and IDF; returns their new ids
+        new_recipes = prepare_recipes(records)
+        if self.snapshot.index.path is None:
+            raise NoIndexError('Build the recipe index before ingesting recipes')
+
+        with file_lock(os.path.join(self.index_dir, DELTA_LOCK)):
+            version_dir = recipe_index.current_version(self.index_dir)
+            first_id = recipe_index.read_meta(version_dir)['n_recipes'] + append_delta(version_dir, new_recipes)
+        self.refresh()
+
+        if auto_compact and self.snapshot.drift >= 1:
+            self.compact_in_background()
+        return list(range(first_id, first_id + len(new_recipes)))
+
+    def compact_in_background(self):
+        # Keep compacting while recipes ingested during the last refit still drift too far
+        def run():
+            while self.compact() and self.snapshot.drift >= 1:
+                pass
+
+        thread = threading.Thread(target=run, name='catalogue-compaction', daemon=True)
+        thread.start()
+        return thread
+
+    def compact(self):
+        # Full refit over base + delta, published as a new index version. Rows
+        # ingested while the refit runs are carried over into the new delta.
+        if not self._compacting.acquire(blocking=False):
+            return False
+        try:
+            with file_lock(os.path.join(self.index_dir, COMPACT_LOCK), blocking=False) as acquired:
+                if not acquired:
+                    return False
+                self.refresh()
+                snapshot = self.snapshot
+                if not snapshot.n_delta:
+                    return False
+
+                # The source CSV is never rewritten. The recipes ingested since it was
+                # built go to the new version's ingested.csv, after the CSV's rows.
+                base = snapshot.index.meta
+                n_csv = base['n_recipes'] - base.get('ingested_rows', 0)
+                recipes = snapshot.recipes.to_frame()
+                ingested_tmp = os.path.join(self.index_dir, recipe_index.INGESTED_FILE + '.tmp')
+                recipes.iloc[n_csv:].to_csv(ingested_tmp, index=False)
+
+                index = recipe_index.fit_index(recipes, csv_sha256=base['csv_sha256'])
+                index.meta.update(ingested_rows=len(recipes) - n_csv,
+                                  ingested_sha256=recipe_index.file_hash(ingested_tmp))
+                version_dir = recipe_index.write_index(index, self.index_dir, publish=False)
+                os.replace(ingested_tmp, os.path.join(version_dir, recipe_index.INGESTED_FILE))
+                if snapshot.dense is not None:
+                    # Refit the embeddings too, with the same settings
+                    embeddings.write(embeddings.fit(index.matrix, snapshot.dense.dims, snapshot.dense.dtype),
+                                     version_dir)
+
+                with file_lock(os.path.join(self.index_dir, DELTA_LOCK)):
+                    tail = read_delta(snapshot.index.path, snapshot.delta_bytes)
+                    if len(tail):
+                        append_delta(version_dir, tail)
+                    recipe_index.publish_index(self.index_dir, version_dir)
+
+                logger.info('Compacted %d delta recipes into %s', snapshot.n_delta, version_dir)
+            self.refresh()
+            return True
+        finally:
+            self._compacting.release()
+
+    def watch(self, interval=5.0):
+        # Poll the index directory so this worker picks up other workers' changes
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.refresh()
+                except Exception:
+                    logger.exception('Catalogue refresh failed')
+
+        stop = threading.Event()
+        threading.Thread(target=run, name='catalogue-watch', daemon=True).start()
+        return stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Add recipes to the index without a full refit.')
+    parser.add_argument('command', choices=['ingest', 'compact'])
+    parser.add_argument('recipes_csv', nargs='?', help='CSV of new recipes (ingest only)')
+    parser.add_argument('--csv', default=recipe_index.DEFAULT_CSV)
+    parser.add_argument('--index-dir', default=recipe_index.DEFAULT_INDEX_DIR)
+    args = parser.parse_args()
+
+    import pandas as pd
+    catalogue = Catalogue(args.csv, args.index_dir)
+    if args.command == 'ingest':
+        if not args.recipes_csv:
+            parser.error('ingest needs a CSV of recipes')
+        recipes = pd.read_csv(args.recipes_csv, dtype={column: str for column in recipe_store.STRING_COLUMNS})
+        ids = catalogue.ingest(recipes.to_dict('records'), auto_compact=False)
+        print('Ingested %d recipes (ids %d-%d), drift %.2f'
+              % (len(ids), ids[0], ids[-1], catalogue.snapshot.drift))
+        # The CLI exits right away, so compact in the foreground if needed
+        if catalogue.snapshot.drift >= 1:
+            catalogue.compact()
+    else:
+        print('Compacted' if catalogue.compact() else 'Nothing to compact')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import threading
+from collections import Counter, defaultdict
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+import recommender
+
+# Only the most recent likes of very active users are used to personalize a query
+MAX_USER_LIKES = 200
+
+
+class CoOccurrenceModel:
+    # "Users who liked this also liked": item-item co-occurrence counts over the
+    # LikedRecipe table. The bulk of the counts is a sparse matrix built once with
+    # U.T @ U; likes arriving afterwards go into a small delta and only mark the
+    # touched recipes dirty, so nothing is recomputed from scratch. Each recipe's
+    # top-N neighbours (cosine over the binary like vectors) are precomputed, so
+    # the online path is a dictionary lookup.
+
+    def __init__(self, n_neighbours=20):
+        self.n_neighbours = n_neighbours
+        self.cooccurrence = csr_matrix((0, 0), dtype=np.int64)
+        self.delta = defaultdict(Counter)
+        self.item_counts = Counter()
+        self.user_likes = defaultdict(dict)
+        self.last_like_id = 0
+        self._neighbours = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def load(self, likes):
+        # Full build from (like_id, user_id, recipe_id) rows
+        likes = list(likes)
+        user_likes = defaultdict(dict)
+        for like_id, user_id, recipe_id in likes:
+            user_likes[user_id].setdefault(recipe_id, like_id)
+
+        pairs = [(user_id, recipe_id) for user_id, items in user_likes.items() for recipe_id in items]
+        n_items = max((recipe_id for _, recipe_id in pairs), default=-1) + 1
+        user_index = {user_id: i for i, user_id in enumerate(user_likes)}
+        rows = np.array([user_index[user_id] for user_id, _ in pairs], dtype=np.int64)
+        cols = np.array([recipe_id for _, recipe_id in pairs], dtype=np.int64)
+        users = csr_matrix((np.ones(len(pairs), dtype=np.int64), (rows, cols)), shape=(len(user_index), n_items))
+
+        cooccurrence = (users.T @ users).tocsr()
+        cooccurrence.setdiag(0)
+        cooccurrence.eliminate_zeros()
+        item_counts = Counter({int(i): int(n) for i, n in zip(*np.unique(cols, return_counts=True))})
+
+        with self._lock:
+            self.cooccurrence = cooccurrence
+            self.delta = defaultdict(Counter)
+            self.item_counts = item_counts
+            self.user_likes = user_likes
+            self.last_like_id = max((like_id for like_id, _, _ in likes), default=0)
+            self._neighbours = {}
+            self._dirty = set(item_counts)
+            self._refresh_dirty()
+
+    def update(self, likes):
+        # Apply new (like_id, user_id, recipe_id) rows; already known likes are ignored
+        with self._lock:
+            for like_id, user_id, recipe_id in likes:
+                self._add(user_id, recipe_id, like_id)
+                if like_id is not None:
+                    self.last_like_id = max(self.last_like_id, like_id)
+            self._refresh_dirty()
+
+    def add_like(self, user_id, recipe_id):
+        self.update([(None, user_id, recipe_id)])
+
+    def _add(self, user_id, recipe_id, like_id):
+        liked = self.user_likes[user_id]
+        if recipe_id in liked:
+            return
+        for other in liked:
+            self.delta[recipe_id][other] += 1
+            self.delta[other][recipe_id] += 1
+            self._dirty.add(other)
+        liked[recipe_id] = like_id if like_id is not None else float('inf')
+        self.item_counts[recipe_id] += 1
+        self._dirty.add(recipe_id)
+
+    def _counts(self, recipe_id):
+        counts = Counter(self.delta.get(recipe_id, ()))
+        if recipe_id < self.cooccurrence.shape[0]:
+            start, end = self.cooccurrence.indptr[recipe_id], self.cooccurrence.indptr[recipe_id + 1]
+            for other, count in zip(self.cooccurrence.indices[start:end], self.cooccurrence.data[start:end]):
+                counts[int(other)] += int(count)
+        return counts
+
+    def _refresh_dirty(self):
+        # A recipe's like count also moves its neighbours' scores slightly; those are
+        # corrected the next time they are touched themselves
+        for recipe_id in self._dirty:
+            counts = self._counts(recipe_id)
+            if not counts:
+                self._neighbours.pop(recipe_id, None)
+                continue
+            ids = np.array(sorted(counts), dtype=np.int64)
+            co = np.array([counts[other] for other in ids], dtype=np.float64)
+            popularity = np.array([self.item_counts[other] for other in ids], dtype=np.float64)
+            similarity = co / np.sqrt(self.item_counts[recipe_id] * popularity)
+            positions, scores = recommender.top_k(similarity, self.n_neighbours)
+            self._neighbours[recipe_id] = (ids[positions], scores)
+        self._dirty = set()
+
+    def similar(self, recipe_id):
+        # Precomputed (ids, scores) of the recipes most often liked together with recipe_id
+        return self._neighbours.get(recipe_id, (np.empty(0, dtype=np.int64), np.empty(0)))
+
+    def liked_by(self, user_id):
+        liked = self.user_likes.get(user_id, {})
+        return sorted(liked, key=liked.get, reverse=True)[:MAX_USER_LIKES]
+
+    def score_for_user(self, user_id):
+        # Sum of neighbour similarities over the user's liked recipes
+        scores = Counter()
+        for liked in self.liked_by(user_id):
+            ids, similarity = self.similar(liked)
+            for other, score in zip(ids.tolist(), similarity.tolist()):
+                scores[other] += score
+        return scores
+
+
+def blend(candidate_ids, content_scores, collaborative_scores, n_recipes, alpha):
+    # Hybrid score alpha * cosine + (1 - alpha) * normalized co-occurrence over the
+    # union of both candidate sets; returns sorted ids and their blended scores
+    collab_ids = np.array([i for i in collaborative_scores if i < n_recipes], dtype=np.int64)
+    if not len(collab_ids):
+        return candidate_ids, content_scores
+
+    collab = np.array([collaborative_scores[i] for i in collab_ids], dtype=np.float64)
+    ids = np.union1d(candidate_ids, collab_ids)
+    scores = np.zeros(len(ids))
+    scores[np.searchsorted(ids, candidate_ids)] += alpha * content_scores
+    scores[np.searchsorted(ids, collab_ids)] += (1 - alpha) * collab / collab.max()
+    return ids, scores
@@ -0,0 +1,178 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+import recipe_index
+
+# Dense recipe embeddings (latent semantic analysis): a truncated SVD of the
+# TF-IDF matrix maps every recipe, and every query, to `dims` numbers. Recipes
+# then match on related ingredients too, not only on exact tokens, and the
+# scoring cost no longer depends on the vocabulary. Built next to an index with
+#   python embeddings.py build --dims 128 --dtype int8
+
+META_FILE = 'embeddings.json'
+COMPONENTS_FILE = 'svd_components.npy'
+VECTORS_FILE = 'embeddings.npy'
+SCALES_FILE = 'embedding_scales.npy'
+
+DEFAULT_DIMS = 128
+DTYPES = ('float32', 'int8')
+
+# int8 rows are widened to float32 this many at a time while scoring, into a
+# scratch block that stays in cache (SCORE_CHUNK * dims * 4 bytes)
+SCORE_CHUNK = 2048
+
+
+class DenseIndex:
+    # components (dims x n_terms) projects TF-IDF rows; vectors (n_recipes x dims)
+    # holds the unit-length projections of the recipes, as float32 or as int8 with
+    # one float32 scale per recipe. The dot product of a projected, unit-length
+    # query with a row is their cosine in the latent space. Recipes appended since
+    # the fit (see extend) are a second, in-memory segment scored after the first,
+    # so the fitted vectors stay memory-mapped and shared between workers.
+
+    def __init__(self, components, vectors, scales=None):
+        self.components = components
+        self.vectors = vectors
+        self.scales = scales
+        # (vectors, scales) of every segment, ids running on from one to the next
+        self.segments = [(vectors, scales)]
+
+    def __len__(self):
+        return sum(len(vectors) for vectors, _ in self.segments)
+
+    @property
+    def dims(self):
+        return self.vectors.shape[1]
+
+    @property
+    def dtype(self):
+        return self.vectors.dtype.name
+
+    @property
+    def nbytes(self):
+        return self.components.nbytes + sum(vectors.nbytes + (scales.nbytes if scales is not None else 0)
+                                            for vectors, scales in self.segments)
+
+    def project(self, matrix):
+        # Unit-length latent rows of a sparse TF-IDF matrix (queries or recipes)
+        projected = np.asarray(matrix @ self.components.T, dtype=np.float32)
+        norms = np.linalg.norm(projected, axis=1, keepdims=True)
+        return projected / np.maximum(norms, np.finfo(np.float32).tiny)
+
+    def score(self, input_vectors):
+        # Cosine scores of each query row over every recipe: one matrix product per segment
+        queries = self.project(input_vectors)
+        scores = np.empty((queries.shape[0], len(self)), dtype=np.float32)
+        scratch = None
+        offset = 0
+        for vectors, scales in self.segments:
+            if scales is None:
+                np.matmul(queries, vectors.T, out=scores[:, offset:offset + len(vectors)])
+            else:
+                if scratch is None:
+                    scratch = np.empty((SCORE_CHUNK, self.dims), dtype=np.float32)
+                for start in range(0, len(vectors), SCORE_CHUNK):
+                    end = min(start + SCORE_CHUNK, len(vectors))
+                    block = scratch[:end - start]
+                    np.copyto(block, vectors[start:end], casting='unsafe')
+                    np.multiply(queries @ block.T, scales[start:end], out=scores[:, offset + start:offset + end])
+            offset += len(vectors)
+        return scores
+
+    def candidates(self, input_vector):
+        # Recipe ids scoring above 0 for one query, with their scores, in the form
+        # recommender.top_k_candidates takes
+        scores = self.score(input_vector)[0]
+        candidate_ids = np.flatnonzero(scores > 0)
+        return candidate_ids, scores[candidate_ids]
+
+    def extend(self, matrix):
+        # A new index with the rows of matrix (recipes added since the fit) appended
+        # to the in-memory segment, projected with the existing components
+        vectors, scales = self.project(matrix), None
+        if self.scales is not None:
+            vectors, scales = quantize(vectors)
+        if len(self.segments) > 1:
+            delta_vectors, delta_scales = self.segments[1]
+            vectors = np.concatenate([delta_vectors, vectors])
+            if scales is not None:
+                scales = np.concatenate([delta_scales, scales])
+        dense = DenseIndex(self.components, self.vectors, self.scales)
+        dense.segments.append((vectors, scales))
+        return dense
+
+
+def quantize(vectors):
+    # Symmetric int8 per recipe row: row ~= scale * int8 row
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    quantized = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def fit(matrix, dims=DEFAULT_DIMS, dtype='float32', seed=0):
+    # Truncated SVD of the recipe TF-IDF matrix. scikit-learn is only imported here.
+    from sklearn.decomposition import TruncatedSVD
+    if dtype not in DTYPES:
+        raise ValueError('dtype must be one of %s' % ', '.join(DTYPES))
+    svd = TruncatedSVD(n_components=min(dims, matrix.shape[1] - 1), random_state=seed)
+    svd.fit(matrix)
+
+    components = np.ascontiguousarray(svd.components_, dtype=np.float32)
+    vectors = DenseIndex(components, None).project(matrix)
+    if dtype == 'int8':
+        return DenseIndex(components, *quantize(vectors))
+    return DenseIndex(components, vectors)
+
+
+def write(dense, version_dir):
+    np.save(os.path.join(version_dir, COMPONENTS_FILE), dense.components)
+    np.save(os.path.join(version_dir, VECTORS_FILE), dense.vectors)
+    if dense.scales is not None:
+        np.save(os.path.join(version_dir, SCALES_FILE), dense.scales)
+
+    # The meta file goes last: its presence means the arrays are complete
+    meta = {'dims': dense.dims, 'dtype': dense.dtype, 'n_recipes': len(dense), 'created_at': time.time()}
+    path = os.path.join(version_dir, META_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(path + '.tmp', path)
+
+
+def load(version_dir):
+    # The memory-mapped embeddings of an index version, or None if it has none
+    try:
+        with open(os.path.join(version_dir, META_FILE)) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    components = np.load(os.path.join(version_dir, COMPONENTS_FILE), mmap_mode='r')
+    vectors = np.load(os.path.join(version_dir, VECTORS_FILE), mmap_mode='r')
+    scales = np.load(os.path.join(version_dir, SCALES_FILE), mmap_mode='r') if meta['dtype'] == 'int8' else None
+    return DenseIndex(components, vectors, scales)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit dense recipe embeddings for the current index.')
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--index-dir', default=recipe_index.DEFAULT_INDEX_DIR)
+    parser.add_argument('--dims', type=int, default=DEFAULT_DIMS)
+    parser.add_argument('--dtype', choices=DTYPES, default='float32')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        start = time.time()
+        index = recipe_index.load_index(args.index_dir)
+        dense = fit(index.matrix, args.dims, args.dtype)
+        write(dense, index.path)
+        print('Embedded %d recipes in %d %s dimensions (%.1fMB) into %s in %.2fs'
+              % (len(dense), dense.dims, dense.dtype, dense.nbytes / 2 ** 20, index.path, time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import numpy as np
+
+
+def parse_list(value):
+    # "onion, garlic" -> ['onion', 'garlic']
+    return [item.strip() for item in (value or '').split(',') if item.strip()]
+
+
+def parse_filters(args):
+    # Filter query parameters of /recommendation; raises ValueError on bad input
+    max_ingredients = args.get('max_ingredients', type=int)
+    if 'max_ingredients' in args and (max_ingredients is None or max_ingredients < 1):
+        raise ValueError('max_ingredients must be a positive integer.')
+
+    filters = {'max_ingredients': max_ingredients,
+               'include': sorted(set(item.lower() for item in parse_list(args.get('include')))),
+               'exclude': sorted(set(item.lower() for item in parse_list(args.get('exclude'))))}
+    return {name: value for name, value in filters.items() if value}
+
+
+def query_args(filters):
+    # Inverse of parse_filters, for building pagination links
+    args = dict(filters)
+    for name in ('include', 'exclude'):
+        if name in args:
+            args[name] = ','.join(args[name])
+    return args
+
+
+def phrase_mask(snapshot, phrase):
+    # Recipes whose ingredients contain every term of the phrase, e.g. "green chilli".
+    # Each term's posting list is its precomputed presence index.
+    mask = np.ones(len(snapshot), dtype=bool)
+    terms = snapshot.vectorizer.build_analyzer()(phrase)
+    for term in terms:
+        term_mask = np.zeros(len(snapshot), dtype=bool)
+        term_mask[snapshot.recipes_with_term(term)] = True
+        mask &= term_mask
+    return mask if terms else np.zeros(len(snapshot), dtype=bool)
+
+
+def build_mask(snapshot, max_ingredients=None, include=(), exclude=()):
+    # Boolean array of the recipes that pass every filter, or None without filters.
+    # Masks are kept on the snapshot, so paging through a filtered query builds one once.
+    if max_ingredients is None and not include and not exclude:
+        return None
+
+    key = (max_ingredients, tuple(include), tuple(exclude))
+    mask = snapshot.filter_masks.get(key)
+    if mask is not None:
+        return mask
+
+    mask = np.ones(len(snapshot), dtype=bool)
+    if max_ingredients is not None:
+        mask &= snapshot.total_ingredients <= max_ingredients
+    for phrase in include:
+        mask &= phrase_mask(snapshot, phrase)
+    for phrase in exclude:
+        mask &= ~phrase_mask(snapshot, phrase)
+    mask.flags.writeable = False
+    snapshot.filter_masks.set(key, mask)
+    return mask
+
+
+def count_allowed(snapshot, **filters):
+    mask = build_mask(snapshot, **filters)
+    return len(snapshot) if mask is None else int(np.count_nonzero(mask))
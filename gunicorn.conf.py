@@ -0,0 +1,32 @@
+import os
+
+# gunicorn app:app -c gunicorn.conf.py
+#
+# The app is imported once in the master, which maps the recipe index and builds
+# the autocomplete before forking, so workers start warm and share those pages
+# copy-on-write. Threads and database connections are opened per worker in post_fork.
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+preload_app = True
+
+# Scoring stays on the request threads unless SCORING_PROCESSES is set; with it each
+# worker scores in its own pool of that many spawned processes. Split the cores
+# between the workers' pools, e.g. SCORING_PROCESSES=$(( $(nproc) / WEB_CONCURRENCY )),
+# and only where bench_scoring shows a gain on the machine.
+
+
+def when_ready(server):
+    import app
+    app.load_recommender()
+    server.log.info('Recommender loaded: %d recipes', len(app.catalogue.snapshot))
+
+
+def post_fork(server, worker):
+    import app
+    # Connections made in the master must not be shared across processes. db.engine
+    # needs an application context.
+    with app.app.app_context():
+        app.db.engine.dispose(close=False)
+    app.start_background_tasks()
@@ -0,0 +1,214 @@
+import multiprocessing
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import recipe_index
+import recipe_store
+
+# Out-of-core build of the index for catalogues larger than memory, writing the
+# same files as recipe_index.write_index. The CSV is read twice, in chunks:
+#   1. document frequencies, which give the vocabulary and IDF, plus the size of
+#      every output array
+#   2. one TF-IDF shard per chunk, written straight into the .npy files at its
+#      offset. The postings are filled in the same pass: their row lengths are
+#      the document frequencies, so each term's slots are known up front.
+# Chunks are tokenized and vectorized in a process pool. Memory is bounded by the
+# chunk size times the chunks in flight, plus the vocabulary, whatever the size
+# of the catalogue. Used by `python recipe_index.py build --chunk-size N`.
+
+DEFAULT_CHUNK_SIZE = 50000
+
+# Set in each pool process by _init_worker
+_analyzer = None
+_vocabulary = None
+_idf = None
+
+
+def _init_worker(vocabulary=None, idf=None):
+    global _analyzer, _vocabulary, _idf
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    # The tokenization of recipe_index.fit_index
+    _analyzer = TfidfVectorizer().build_analyzer()
+    _vocabulary = vocabulary
+    _idf = idf
+
+
+def _count_chunk(chunk):
+    # Pass 1: rows, non-zeros, document frequencies and string bytes of one chunk
+    frequencies = Counter()
+    nnz = 0
+    for text in recipe_index.prepare_ingredients(chunk):
+        terms = set(_analyzer(text))
+        frequencies.update(terms)
+        nnz += len(terms)
+    store = recipe_store.RecipeStore.from_frame(chunk)
+    string_bytes = {column: len(blob) for column, (_, blob) in store.strings.items()}
+    return len(chunk), nnz, frequencies, string_bytes
+
+
+def _vectorize_chunk(chunk):
+    # Pass 2: the chunk's rows of the L2-normalized TF-IDF matrix, as fit_index
+    # computes them, plus its columnar recipe store
+    row_lengths, indices, counts = [], [], []
+    for text in recipe_index.prepare_ingredients(chunk):
+        row = sorted(Counter(_vocabulary[term] for term in _analyzer(text)).items())
+        row_lengths.append(len(row))
+        indices.extend(column for column, _ in row)
+        counts.extend(count for _, count in row)
+
+    row_lengths = np.array(row_lengths, dtype=np.int64)
+    indices = np.array(indices, dtype=np.int64)
+    data = np.array(counts, dtype=np.float64) * _idf[indices]
+    rows = np.repeat(np.arange(len(row_lengths)), row_lengths)
+    norms = np.sqrt(np.bincount(rows, weights=data ** 2, minlength=len(row_lengths)))
+    norms[norms == 0] = 1
+    data /= norms[rows]
+    return row_lengths, indices, data, recipe_store.RecipeStore.from_frame(chunk)
+
+
+def _read_chunks(csv_path, chunk_size):
+    import pandas as pd
+    # Strings stay strings in every chunk, whatever a chunk's values look like
+    return pd.read_csv(csv_path, chunksize=chunk_size, dtype={column: str for column in recipe_store.STRING_COLUMNS})
+
+
+def _run(func, chunks, processes, initargs=()):
+    # func over the chunks, results in order, with at most 2 chunks per process in flight
+    if not processes:
+        _init_worker(*initargs)
+        yield from map(func, chunks)
+        return
+
+    with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=initargs) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(func, chunk))
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class _ArrayFile:
+    # A 1-d .npy file of known dtype and length, filled by writes at element
+    # offsets. Plain file writes rather than a memory map, so nothing written stays
+    # resident in the builder.
+
+    def __init__(self, version_dir, name, dtype, length):
+        self.dtype = np.dtype(dtype)
+        self.file = open(os.path.join(version_dir, name + '.npy'), 'wb')
+        np.lib.format.write_array_header_1_0(self.file, {
+            'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': False, 'shape': (length,)})
+        self.start = self.file.tell()
+        self.file.truncate(self.start + length * self.dtype.itemsize)
+
+    def write(self, position, values):
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+        os.pwrite(self.file.fileno(), values.data, self.start + position * self.dtype.itemsize)
+
+    def close(self):
+        self.file.close()
+
+
+def build_index(csv_path=recipe_index.DEFAULT_CSV, index_dir=recipe_index.DEFAULT_INDEX_DIR,
+                chunk_size=DEFAULT_CHUNK_SIZE, processes=None, publish=True):
+    # Returns (version_dir, meta) of the new index
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    # Pass 1
+    n_recipes = nnz = 0
+    frequencies = Counter()
+    string_bytes = Counter()
+    for rows, chunk_nnz, chunk_frequencies, chunk_bytes in _run(_count_chunk, _read_chunks(csv_path, chunk_size),
+                                                                 processes):
+        n_recipes += rows
+        nnz += chunk_nnz
+        frequencies.update(chunk_frequencies)
+        string_bytes.update(chunk_bytes)
+
+    terms = sorted(frequencies)
+    document_frequency = np.array([frequencies[term] for term in terms], dtype=np.int64)
+    # TfidfVectorizer's smoothed IDF
+    idf = np.log((1 + n_recipes) / (1 + document_frequency)) + 1
+    vocabulary = {term: column for column, term in enumerate(terms)}
+    del frequencies
+
+    meta = {
+        'format': recipe_index.INDEX_FORMAT,
+        'csv_sha256': recipe_index.file_hash(csv_path),
+        'n_recipes': n_recipes,
+        'n_terms': len(terms),
+        'created_at': time.time(),
+    }
+    version_dir = recipe_index.make_version_dir(index_dir, meta)
+
+    # scipy wants indices and indptr of one dtype; int32 as long as everything fits
+    index_dtype = np.int32 if max(nnz, n_recipes, len(terms)) < 2 ** 31 else np.int64
+    prefix = recipe_index.POSTINGS_PREFIX
+    matrix = {name: _ArrayFile(version_dir, name, dtype, length) for name, dtype, length in
+              [('data', np.float64, nnz), ('indices', index_dtype, nnz), ('indptr', index_dtype, n_recipes + 1)]}
+    postings = {name: _ArrayFile(version_dir, prefix + name, dtype, length) for name, dtype, length in
+                [('data', np.float64, nnz), ('indices', index_dtype, nnz), ('indptr', index_dtype, len(terms) + 1)]}
+    store = recipe_store.STORE_PREFIX
+    numeric = {column: _ArrayFile(version_dir, store + column, dtype, n_recipes)
+               for column, dtype in recipe_store.NUMERIC_COLUMNS.items()}
+    strings = {column: (_ArrayFile(version_dir, store + column + '_offsets', np.int64, n_recipes + 1),
+                        _ArrayFile(version_dir, store + column + '_blob', np.uint8, string_bytes[column]))
+               for column in recipe_store.STRING_COLUMNS}
+
+    # Each term's posting list starts where the previous term's ends
+    postings_indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum(document_frequency, out=postings_indptr[1:])
+    postings['indptr'].write(0, postings_indptr)
+    # Next free slot of each term's posting list
+    postings_fill = postings_indptr[:-1].copy()
+    del postings_indptr
+
+    # Pass 2, shards in recipe order
+    matrix['indptr'].write(0, [0])
+    blob_ends = {column: 0 for column in strings}
+    for offsets, _ in strings.values():
+        offsets.write(0, [0])
+    row = position = 0
+    for row_lengths, shard_indices, shard_data, shard_store in _run(
+            _vectorize_chunk, _read_chunks(csv_path, chunk_size), processes, (vocabulary, idf)):
+        rows = len(row_lengths)
+        matrix['data'].write(position, shard_data)
+        matrix['indices'].write(position, shard_indices)
+        matrix['indptr'].write(row + 1, position + np.cumsum(row_lengths))
+
+        # Transpose the shard into the postings: grouped by term, recipes stay in
+        # order, and each term's entries go to the next free slots of its list
+        order = np.argsort(shard_indices, kind='stable')
+        shard_terms, starts, counts = np.unique(shard_indices[order], return_index=True, return_counts=True)
+        shard_rows = row + np.repeat(np.arange(rows), row_lengths)[order]
+        shard_values = shard_data[order]
+        for term, start, count in zip(shard_terms.tolist(), starts.tolist(), counts.tolist()):
+            postings['indices'].write(postings_fill[term], shard_rows[start:start + count])
+            postings['data'].write(postings_fill[term], shard_values[start:start + count])
+        postings_fill[shard_terms] += counts
+
+        for column, values in shard_store.numeric.items():
+            numeric[column].write(row, values)
+        for column, (shard_offsets, shard_blob) in shard_store.strings.items():
+            offsets, blob = strings[column]
+            offsets.write(row + 1, blob_ends[column] + shard_offsets[1:])
+            blob.write(blob_ends[column], shard_blob)
+            blob_ends[column] += len(shard_blob)
+
+        row, position = row + rows, position + len(shard_indices)
+
+    for array in [*matrix.values(), *postings.values(), *numeric.values(),
+                  *(array for pair in strings.values() for array in pair)]:
+        array.close()
+
+    recipe_index.write_model(version_dir, terms, idf, meta)
+    if publish:
+        recipe_index.publish_index(index_dir, version_dir)
+    return version_dir, meta
@@ -0,0 +1,166 @@
+import logging
+import threading
+
+from sqlalchemy import UniqueConstraint, delete, func, inspect, select, text, tuple_
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+logger = logging.getLogger(__name__)
+
+
+def insert_ignore(table, dialect_name):
+    # INSERT that silently skips rows violating the (user_id, recipe_id) unique
+    # constraint, so a like needs no SELECT first and duplicate clicks can't race
+    if dialect_name == 'mysql':
+        return mysql.insert(table).prefix_with('IGNORE')
+    if dialect_name == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing(index_elements=['user_id', 'recipe_id'])
+    if dialect_name == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing(index_elements=['user_id', 'recipe_id'])
+    raise ValueError('insert-or-ignore is not supported for %s' % dialect_name)
+
+
+def _insert_statement(table, dialect, n_rows):
+    # insert_ignore, returning the pairs it wrote where the dialect can
+    statement = insert_ignore(table, dialect.name)
+    if dialect.insert_executemany_returning or (n_rows == 1 and dialect.insert_returning):
+        statement = statement.returning(table.c.user_id, table.c.recipe_id)
+    return statement
+
+
+def _stored_pairs(result, rows):
+    # The (user_id, recipe_id) pairs the insert wrote, or None when the dialect has
+    # no RETURNING and only some of several rows were written
+    if result.returns_rows:
+        return {tuple(row) for row in result}
+    if result.rowcount == len(rows):
+        return {(row['user_id'], row['recipe_id']) for row in rows}
+    if result.rowcount == 0:
+        return set()
+    return None
+
+
+def _written_rows(table, rows):
+    # Only for a partly ignored batch without RETURNING (MySQL): the rows this
+    # insert wrote are the ones carrying its timestamps
+    keys = [(row['user_id'], row['recipe_id'], row['created_at']) for row in rows]
+    return select(table.c.user_id, table.c.recipe_id).where(
+        tuple_(table.c.user_id, table.c.recipe_id, table.c.created_at).in_(keys))
+
+
+def insert_likes(session, table, rows):
+    # Returns the set of (user_id, recipe_id) pairs actually written
+    statement = _insert_statement(table, session.get_bind().dialect, len(rows))
+    stored = _stored_pairs(session.execute(statement, rows), rows)
+    if stored is None:
+        stored = {tuple(row) for row in session.execute(_written_rows(table, rows))}
+    return stored
+
+
+async def insert_likes_async(session, table, rows):
+    # insert_likes for an AsyncSession
+    statement = _insert_statement(table, session.bind.dialect, len(rows))
+    stored = _stored_pairs(await session.execute(statement, rows), rows)
+    if stored is None:
+        stored = {tuple(row) for row in await session.execute(_written_rows(table, rows))}
+    return stored
+
+
+def upsert(session, table, rows, key):
+    # INSERT of rows that replaces the existing row with the same key (a primary key
+    # or unique column), so no SELECT is needed to choose between INSERT and UPDATE
+    dialect_name = session.get_bind().dialect.name
+    columns = [column.name for column in table.columns if column.name != key]
+    if dialect_name == 'mysql':
+        statement = mysql.insert(table)
+        statement = statement.on_duplicate_key_update({column: statement.inserted[column] for column in columns})
+    elif dialect_name in ('postgresql', 'sqlite'):
+        statement = (postgresql if dialect_name == 'postgresql' else sqlite).insert(table)
+        statement = statement.on_conflict_do_update(index_elements=[key],
+                                                    set_={column: statement.excluded[column] for column in columns})
+    else:
+        raise ValueError('upsert is not supported for %s' % dialect_name)
+    session.execute(statement, rows)
+
+
+def migrate(connection, table):
+    # Brings a liked_recipe table created before its unique (user_id, recipe_id)
+    # constraint up to date; insert_ignore has nothing to conflict with until then.
+    # Duplicate likes are deleted, keeping each pair's first row, then the missing
+    # unique and (user_id, created_at) indexes are created. A unique index stands in
+    # for the constraint, since SQLite can't add one to an existing table. Returns
+    # the ids of the users that had duplicates.
+    inspector = inspect(connection)
+    existing = {index['name'] for index in inspector.get_indexes(table.name)}
+    existing |= {constraint['name'] for constraint in inspector.get_unique_constraints(table.name)}
+
+    affected = set()
+    for constraint in table.constraints:
+        if not isinstance(constraint, UniqueConstraint) or constraint.name in existing:
+            continue
+        columns = list(constraint.columns)
+        # Selected through a derived table, as MySQL can't delete from a table it reads
+        keep = select(func.min(table.c.id).label('id')).group_by(*columns).subquery()
+        duplicates = table.c.id.not_in(select(keep.c.id))
+        affected.update(connection.execute(select(table.c.user_id).where(duplicates).distinct()).scalars())
+        removed = connection.execute(delete(table).where(duplicates)).rowcount
+        connection.execute(text('CREATE UNIQUE INDEX %s ON %s (%s)' % (
+            constraint.name, table.name, ', '.join(column.name for column in columns))))
+        logger.info('Removed %d duplicate rows from %s and added %s', removed, table.name, constraint.name)
+
+    for index in table.indexes:
+        if index.name not in existing:
+            index.create(connection)
+            logger.info('Added %s to %s', index.name, table.name)
+    return affected
+
+
+class LikeBuffer:
+    # Write-behind buffer: likes are queued in memory and written in one
+    # transaction every flush_interval seconds, or as soon as max_rows are waiting.
+    # write(rows) must insert and commit the rows.
+
+    def __init__(self, write, max_rows=500, flush_interval=0.2):
+        self.write = write
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self._rows = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='like-buffer', daemon=True)
+        self._thread.start()
+
+    def add(self, user_id, recipe_id, created_at):
+        with self._lock:
+            # Repeated clicks before a flush collapse into one row
+            self._rows.setdefault((user_id, recipe_id),
+                                  {'user_id': user_id, 'recipe_id': recipe_id, 'created_at': created_at})
+            full = len(self._rows) >= self.max_rows
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        # _flush_lock keeps batches in order when close() races the background thread
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = list(self._rows.values()), {}
+            if rows:
+                try:
+                    self.write(rows)
+                except Exception:
+                    logger.exception('Dropped %d buffered likes', len(rows))
+            return len(rows)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def close(self):
+        # Flush whatever is left; registered with atexit so a clean shutdown loses nothing
+        self._closed = True
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self.flush()
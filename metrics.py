@@ -0,0 +1,222 @@
+import contextvars
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+# Latency buckets in seconds, from sub-millisecond cache hits to slow renders
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Stats of the request being served on this thread, if any
+current_request = contextvars.ContextVar('current_request', default=None)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in labels)
+
+
+class Histogram:
+    # Fixed buckets, so observing is a bisect and two additions under a lock
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            yield '%s_bucket%s %d' % (name, format_labels(labels + (('le', bound),)), cumulative)
+        yield '%s_sum%s %r' % (name, format_labels(labels), total)
+        yield '%s_count%s %d' % (name, format_labels(labels), cumulative)
+
+
+class Registry:
+    # Metrics of this worker process, rendered in the Prometheus text format.
+    # Every worker keeps its own; Prometheus adds them up across scrape targets.
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.callbacks = {}
+        self.help = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        key = (name, tuple(labels))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram(buckets))
+                self.help[name] = ('histogram', help)
+        return histogram
+
+    def inc(self, name, help, labels=(), value=1):
+        key = (name, tuple(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+            self.help[name] = ('counter', help)
+
+    def callback(self, name, help, read, kind='gauge'):
+        # A value kept elsewhere, e.g. a cache's hit count; read() is called on every scrape
+        self.callbacks[name] = read
+        self.help[name] = (kind, help)
+
+    def render(self):
+        series = {}
+        for (name, labels), histogram in list(self.histograms.items()):
+            series.setdefault(name, []).extend(histogram.samples(name, labels))
+        for (name, labels), value in list(self.counters.items()):
+            series.setdefault(name, []).append('%s%s %r' % (name, format_labels(labels), value))
+        for name, read in list(self.callbacks.items()):
+            series.setdefault(name, []).append('%s %r' % (name, read()))
+
+        lines = []
+        for name in sorted(series):
+            kind, help = self.help[name]
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            lines.extend(series[name])
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+stage_histograms = {}
+
+
+class span:
+    # Time one stage of the hot path: with metrics.span('transform'): ...
+    # A plain class rather than @contextmanager, since it wraps every stage of every request.
+    __slots__ = ('histogram', 'stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.histogram = stage_histograms.get(stage) or registry.histogram(
+            'recipe_bowl_stage_seconds', 'Time spent in each stage of serving a request', (('stage', stage),))
+        stage_histograms[stage] = self.histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        self.histogram.observe(elapsed)
+        stats = current_request.get()
+        if stats is not None:
+            stats['stages'][self.stage] = stats['stages'].get(self.stage, 0.0) + elapsed
+
+
+def timed(stage, func):
+    # func wrapped in a span, for callables handed to other modules
+    def wrapper(*args, **kwargs):
+        with span(stage):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def begin_request():
+    stats = {'start': time.perf_counter(), 'queries': 0, 'query_seconds': 0.0, 'stages': {}}
+    current_request.set(stats)
+    return stats
+
+
+def end_request(endpoint, status):
+    # Record the request that begin_request started on this thread; returns its stats
+    stats = current_request.get()
+    if stats is None:
+        return None
+    current_request.set(None)
+    stats['duration'] = time.perf_counter() - stats['start']
+
+    labels = (('endpoint', endpoint),)
+    registry.histogram('recipe_bowl_request_seconds', 'Request latency by endpoint', labels).observe(stats['duration'])
+    registry.histogram('recipe_bowl_request_db_queries', 'Database queries per request by endpoint', labels,
+                       buckets=QUERY_BUCKETS).observe(stats['queries'])
+    registry.inc('recipe_bowl_requests_total', 'Requests by endpoint and status', labels + (('status', status),))
+    return stats
+
+
+def track_queries(engine):
+    # Count and time every SQL statement run through engine (an Engine or the Engine class)
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        registry.histogram('recipe_bowl_db_query_seconds', 'Database query latency').observe(elapsed)
+        stats = current_request.get()
+        if stats is not None:
+            stats['queries'] += 1
+            stats['query_seconds'] += elapsed
+
+
+def fold_stack(frame):
+    # "module:function;module:function;..." from the outermost call to frame
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s:%s' % (os.path.splitext(os.path.basename(code.co_filename))[0], code.co_name))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class SamplingProfiler:
+    # Opt-in sampler: while a request runs, its thread's stack is sampled every
+    # interval seconds. Requests slower than threshold seconds get their samples
+    # written to output_dir in the folded format that flamegraph.pl and speedscope read.
+
+    def __init__(self, output_dir, threshold=1.0, interval=0.005):
+        self.output_dir = output_dir
+        self.threshold = threshold
+        self.interval = interval
+        self._samples = {}
+        self._lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+        threading.Thread(target=self._run, name='sampling-profiler', daemon=True).start()
+
+    def begin(self):
+        with self._lock:
+            self._samples[threading.get_ident()] = Counter()
+
+    def end(self, label, duration):
+        # Returns the path written, if the request was slow enough
+        with self._lock:
+            samples = self._samples.pop(threading.get_ident(), None)
+        if not samples or duration < self.threshold:
+            return None
+
+        path = os.path.join(self.output_dir, '%s-%d-%d.folded' % (label, time.time() * 1000, threading.get_ident()))
+        with open(path, 'w') as f:
+            for stack, count in samples.most_common():
+                f.write('%s %d\n' % (stack, count))
+        return path
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, samples in self._samples.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[fold_stack(frame)] += 1
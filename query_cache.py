@@ -0,0 +1,168 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def normalize_ingredients(ingredients):
+    # "Onion, tomato" and "tomato,onion " are the same pantry: lowercase, collapse
+    # whitespace, drop empty entries and duplicates, and sort
+    items = {' '.join(item.lower().split()) for item in ingredients}
+    items.discard('')
+    return tuple(sorted(items))
+
+
+def make_key(*parts):
+    return json.dumps(parts, separators=(',', ':'))
+
+
+def make_etag(*parts):
+    # Validator for a response that depends on nothing but parts
+    return hashlib.sha256(make_key(*parts).encode('utf-8')).hexdigest()[:32]
+
+
+class LRUCache:
+    # Bounded in-process cache; entries expire after ttl seconds and the least
+    # recently used entry is evicted once maxsize is reached
+
+    def __init__(self, maxsize=4096, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'backend': 'memory', 'size': len(self._entries), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses}
+
+
+class SQLiteCache:
+    # Cache shared by every worker on the host through one SQLite file. Values must
+    # be JSON serializable; hit/miss counters are per worker.
+
+    # Expired and least recently used rows are trimmed once every this many writes
+    TRIM_EVERY = 64
+
+    def __init__(self, path, maxsize=4096, ttl=600):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._local = threading.local()
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS query_cache '
+            '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)')
+
+    def _connect(self):
+        # sqlite3 connections can't be shared between threads, so keep one per thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute('SELECT value, expires_at FROM query_cache WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < now:
+            self.misses += 1
+            return None
+        conn.execute('UPDATE query_cache SET accessed_at = ? WHERE key = ?', (now, key))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        conn = self._connect()
+        now = time.time()
+        conn.execute('INSERT OR REPLACE INTO query_cache VALUES (?, ?, ?, ?)',
+                     (key, json.dumps(value), now + self.ttl, now))
+
+        self._writes += 1
+        if self._writes % self.TRIM_EVERY == 0:
+            conn.execute('DELETE FROM query_cache WHERE expires_at < ?', (now,))
+            conn.execute('DELETE FROM query_cache WHERE key IN '
+                         '(SELECT key FROM query_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                         (self.maxsize,))
+
+    def clear(self):
+        self._connect().execute('DELETE FROM query_cache')
+
+    def stats(self):
+        size = self._connect().execute('SELECT COUNT(*) FROM query_cache').fetchone()[0]
+        return {'backend': 'sqlite', 'size': size, 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses}
+
+
+class SingleFlight:
+    # Coalesces concurrent calls with the same key: the first caller computes, the
+    # callers arriving while it runs wait and share its result (or its exception).
+    # Nothing is kept once the computation finishes; that is the cache's job.
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, compute):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return call.result()
+
+        try:
+            result = compute()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self):
+        return {'in_flight': len(self._calls), 'coalesced': self.coalesced}
+
+
+def create_cache(path=None, maxsize=4096, ttl=600):
+    if path:
+        return SQLiteCache(path, maxsize=maxsize, ttl=ttl)
+    return LRUCache(maxsize=maxsize, ttl=ttl)
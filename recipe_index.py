@@ -0,0 +1,217 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from recipe_store import RecipeStore
+
+DEFAULT_CSV = 'recipes1.csv'
+DEFAULT_INDEX_DIR = 'recipe_index'
+
+# Bump whenever the on-disk layout changes so old indexes are rejected
+INDEX_FORMAT = 3
+
+CURRENT_FILE = 'CURRENT'
+META_FILE = 'meta.json'
+VOCABULARY_FILE = 'vocabulary.json'
+MATRIX_FILES = ('data', 'indices', 'indptr')
+POSTINGS_PREFIX = 'postings_'
+# Recipes ingested since the source CSV, folded into a version by compaction. They
+# follow the CSV's rows; meta.json records how many there are and their hash.
+INGESTED_FILE = 'ingested.csv'
+
+
+class StaleIndexError(Exception):
+    pass
+
+
+class RecipeIndex:
+    def __init__(self, vectorizer, matrix, meta, postings=None, path=None, store=None):
+        self.vectorizer = vectorizer
+        self.matrix = matrix
+        self.meta = meta
+        # The recipes themselves, row i of the matrix being recipe i
+        self.store = store
+        # Term-major copy of the matrix: row t lists the recipes containing term t
+        self.postings = postings if postings is not None else build_postings(matrix)
+        self.path = path
+
+    @property
+    def version(self):
+        # The source CSV's hash, combined with the ingested recipes' when there are any
+        if not self.meta.get('ingested_rows'):
+            return self.meta['csv_sha256']
+        return hashlib.sha256((self.meta['csv_sha256'] + self.meta['ingested_sha256']).encode()).hexdigest()
+
+
+def file_hash(path, chunk_size=1 << 20):
+    # Content hash of the source CSV, streamed so large catalogues don't need to fit in memory
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def prepare_ingredients(recipe_df):
+    return recipe_df['ingredients'].apply(lambda x: ', '.join(x.split(', ')))
+
+
+def build_postings(matrix):
+    postings = matrix.T.tocsr()
+    postings.sort_indices()
+    return postings
+
+
+def fit_index(recipe_df, csv_sha256=None):
+    # Fit the TF-IDF model in-process, exactly as the app used to do at import time.
+    # scikit-learn takes a second to import, so it is only imported when needed.
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    vectorizer = TfidfVectorizer()
+    matrix = vectorizer.fit_transform(prepare_ingredients(recipe_df))
+    meta = {
+        'format': INDEX_FORMAT,
+        'csv_sha256': csv_sha256,
+        'n_recipes': matrix.shape[0],
+        'n_terms': matrix.shape[1],
+        'created_at': time.time(),
+    }
+    return RecipeIndex(vectorizer, matrix, meta, store=RecipeStore.from_frame(recipe_df))
+
+
+def write_index(index, index_dir, publish=True):
+    # Every build goes into its own sub-directory; the CURRENT pointer is swapped
+    # atomically afterwards so running readers never see a half-written index.
+    version_dir = make_version_dir(index_dir, index.meta)
+
+    matrix = index.matrix
+    for name in MATRIX_FILES:
+        np.save(os.path.join(version_dir, name + '.npy'), getattr(matrix, name))
+        np.save(os.path.join(version_dir, POSTINGS_PREFIX + name + '.npy'), getattr(index.postings, name))
+    index.store.save(version_dir)
+
+    # Terms ordered by column so the vocabulary can be rebuilt from its position
+    terms = sorted(index.vectorizer.vocabulary_, key=index.vectorizer.vocabulary_.get)
+    write_model(version_dir, terms, index.vectorizer.idf_, index.meta)
+    index.path = version_dir
+    if publish:
+        publish_index(index_dir, version_dir)
+    return version_dir
+
+
+def make_version_dir(index_dir, meta):
+    version_dir = os.path.join(index_dir, '%s-%d' % (meta['csv_sha256'][:16], int(meta['created_at'] * 1000)))
+    os.makedirs(version_dir, exist_ok=True)
+    return version_dir
+
+
+def write_model(version_dir, terms, idf, meta):
+    # Vocabulary, IDF weights and meta.json; meta.json goes last
+    np.save(os.path.join(version_dir, 'idf.npy'), idf.astype(np.float64, copy=False))
+    with open(os.path.join(version_dir, VOCABULARY_FILE), 'w') as f:
+        json.dump(terms, f)
+    with open(os.path.join(version_dir, META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+
+def publish_index(index_dir, version_dir):
+    pointer = os.path.join(index_dir, CURRENT_FILE)
+    with open(pointer + '.tmp', 'w') as f:
+        f.write(os.path.basename(version_dir))
+    os.replace(pointer + '.tmp', pointer)
+
+    _remove_old_versions(index_dir, os.path.basename(version_dir))
+
+
+def current_version(index_dir=DEFAULT_INDEX_DIR):
+    with open(os.path.join(index_dir, CURRENT_FILE)) as f:
+        return os.path.join(index_dir, f.read().strip())
+
+
+def read_meta(version_dir):
+    with open(os.path.join(version_dir, META_FILE)) as f:
+        return json.load(f)
+
+
+def _remove_old_versions(index_dir, keep):
+    # Workers that already mapped an old version keep their pages alive after unlink
+    for name in os.listdir(index_dir):
+        path = os.path.join(index_dir, name)
+        if name != keep and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def build_index(csv_path=DEFAULT_CSV, index_dir=DEFAULT_INDEX_DIR):
+    import pandas as pd
+    recipe_df = pd.read_csv(csv_path)
+    index = fit_index(recipe_df, csv_sha256=file_hash(csv_path))
+    write_index(index, index_dir)
+    return index
+
+
+def load_index(index_dir=DEFAULT_INDEX_DIR, csv_path=None):
+    version_dir = current_version(index_dir)
+    meta = read_meta(version_dir)
+
+    if meta.get('format') != INDEX_FORMAT:
+        raise StaleIndexError('Index format %r is not supported' % meta.get('format'))
+
+    # Reject an index built from a different version of the CSV
+    if csv_path is not None and meta['csv_sha256'] != file_hash(csv_path):
+        raise StaleIndexError('Index at %s was built from a different %s' % (version_dir, csv_path))
+
+    with open(os.path.join(version_dir, VOCABULARY_FILE)) as f:
+        terms = json.load(f)
+
+    # Memory-map the big arrays so every worker shares the same page cache
+    matrix = _load_csr(version_dir, '', (meta['n_recipes'], meta['n_terms']))
+    postings = _load_csr(version_dir, POSTINGS_PREFIX, (meta['n_terms'], meta['n_recipes']))
+
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    vectorizer = TfidfVectorizer(vocabulary={term: i for i, term in enumerate(terms)})
+    vectorizer.idf_ = np.load(os.path.join(version_dir, 'idf.npy'))
+
+    return RecipeIndex(vectorizer, matrix, meta, postings=postings, path=version_dir,
+                       store=RecipeStore.load(version_dir))
+
+
+def load_postings(version_dir):
+    # Only the term-major matrix, memory-mapped, for processes that just score queries
+    meta = read_meta(version_dir)
+    return _load_csr(version_dir, POSTINGS_PREFIX, (meta['n_terms'], meta['n_recipes']))
+
+
+def _load_csr(version_dir, prefix, shape):
+    arrays = [np.load(os.path.join(version_dir, prefix + name + '.npy'), mmap_mode='r') for name in MATRIX_FILES]
+    return csr_matrix(tuple(arrays), shape=shape, copy=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the recipe TF-IDF index used by the app.')
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--csv', default=DEFAULT_CSV)
+    parser.add_argument('--index-dir', default=DEFAULT_INDEX_DIR)
+    parser.add_argument('--chunk-size', type=int, default=0,
+                        help='Stream the CSV in chunks of this many recipes, for catalogues larger than memory')
+    parser.add_argument('--processes', type=int, help='Processes vectorizing chunks (default: one per CPU)')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        start = time.time()
+        if args.chunk_size:
+            import index_builder
+            path, meta = index_builder.build_index(args.csv, args.index_dir, args.chunk_size, args.processes)
+        else:
+            index = build_index(args.csv, args.index_dir)
+            path, meta = index.path, index.meta
+        print('Indexed %d recipes / %d terms into %s in %.2fs'
+              % (meta['n_recipes'], meta['n_terms'], path, time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import os
+from bisect import bisect_right
+
+import numpy as np
+
+STRING_COLUMNS = ['name', 'ingredients', 'steps', 'url']
+NUMERIC_COLUMNS = {'totalingredients': np.int32}
+COLUMNS = STRING_COLUMNS + list(NUMERIC_COLUMNS)
+
+STORE_PREFIX = 'recipes_'
+
+
+class Recipe:
+    # Row view over a store: just the store and an id, with each field decoded on
+    # access. Supports recipe['name'] and recipe.name, so templates work unchanged.
+    __slots__ = ('store', 'recipe_id', 'score')
+
+    def __init__(self, store, recipe_id, score=None):
+        self.store = store
+        self.recipe_id = recipe_id
+        self.score = score
+
+    def __getitem__(self, column):
+        if column in self.__slots__:
+            return getattr(self, column)
+        return self.store.value(self.recipe_id, column)
+
+    def __getattr__(self, column):
+        # Only reached for names that are not slots, i.e. the recipe's columns
+        if column in self.__slots__:
+            raise AttributeError(column)
+        try:
+            return self.store.value(self.recipe_id, column)
+        except KeyError:
+            raise AttributeError(column) from None
+
+
+class RecipeStore:
+    # Read-only columnar recipe table. Numeric columns are fixed-width arrays and
+    # string columns are one utf-8 blob plus n + 1 offsets, all saved as .npy files
+    # next to the TF-IDF arrays and memory-mapped, so every worker shares a single
+    # copy in the page cache instead of holding the catalogue as Python objects.
+
+    def __init__(self, numeric, strings):
+        self.numeric = numeric
+        self.strings = strings
+
+    @classmethod
+    def from_frame(cls, recipes):
+        numeric = {}
+        for column, dtype in NUMERIC_COLUMNS.items():
+            numeric[column] = (recipes[column].fillna(0).to_numpy(dtype=dtype) if column in recipes
+                               else np.zeros(len(recipes), dtype=dtype))
+
+        strings = {}
+        for column in STRING_COLUMNS:
+            values = recipes[column].fillna('') if column in recipes else [''] * len(recipes)
+            encoded = [str(value).encode('utf-8') for value in values]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(value) for value in encoded], out=offsets[1:])
+            strings[column] = (offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8))
+        return cls(numeric, strings)
+
+    def save(self, directory):
+        for column, values in self.numeric.items():
+            np.save(os.path.join(directory, STORE_PREFIX + column + '.npy'), values)
+        for column, (offsets, blob) in self.strings.items():
+            np.save(os.path.join(directory, STORE_PREFIX + column + '_offsets.npy'), offsets)
+            np.save(os.path.join(directory, STORE_PREFIX + column + '_blob.npy'), blob)
+
+    @classmethod
+    def load(cls, directory):
+        def load(name):
+            return np.load(os.path.join(directory, STORE_PREFIX + name + '.npy'), mmap_mode='r')
+
+        numeric = {column: load(column) for column in NUMERIC_COLUMNS}
+        strings = {column: (load(column + '_offsets'), load(column + '_blob')) for column in STRING_COLUMNS}
+        return cls(numeric, strings)
+
+    def __len__(self):
+        return len(self.strings[STRING_COLUMNS[0]][0]) - 1
+
+    def __getitem__(self, recipe_id):
+        return Recipe(self, recipe_id)
+
+    def value(self, recipe_id, column):
+        # Raises KeyError for unknown columns
+        if column in self.strings:
+            offsets, blob = self.strings[column]
+            return blob[offsets[recipe_id]:offsets[recipe_id + 1]].tobytes().decode('utf-8')
+        return self.numeric[column][recipe_id].item()
+
+    def column(self, column):
+        # Numeric columns as an array, string columns as a list
+        if column in self.strings:
+            offsets, blob = self.strings[column]
+            data = blob.tobytes()
+            return [data[start:end].decode('utf-8') for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+        return self.numeric[column]
+
+    def to_frame(self):
+        return to_frame(self)
+
+
+class ChainedStore:
+    # Several stores read as one, ids running on from one store to the next; used
+    # for the base catalogue followed by its delta segment
+    def __init__(self, stores):
+        self.stores = stores
+        self.starts = np.cumsum([0] + [len(store) for store in stores]).tolist()
+
+    def __len__(self):
+        return self.starts[-1]
+
+    def __getitem__(self, recipe_id):
+        return Recipe(self, recipe_id)
+
+    def value(self, recipe_id, column):
+        i = bisect_right(self.starts, recipe_id) - 1
+        return self.stores[i].value(recipe_id - self.starts[i], column)
+
+    def column(self, column):
+        columns = [store.column(column) for store in self.stores]
+        if column in NUMERIC_COLUMNS:
+            return np.concatenate(columns)
+        return [value for values in columns for value in values]
+
+    def to_frame(self):
+        return to_frame(self)
+
+
+def to_frame(store):
+    # The whole catalogue as a DataFrame, for compaction
+    import pandas as pd
+    return pd.DataFrame({column: store.column(column) for column in COLUMNS})
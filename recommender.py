@@ -0,0 +1,95 @@
+import numpy as np
+from scipy.sparse import hstack
+
+DEFAULT_K = 5
+MAX_K = 50
+
+
+def top_k(scores, k, offset=0):
+    # Return the indices and scores of ranks [offset, offset + k) without sorting
+    # the whole similarity vector. Higher scores come first and ties are broken by
+    # the lower recipe index, so consecutive pages never overlap or skip a recipe.
+    scores = np.asarray(scores)
+    n = offset + k
+    if k <= 0 or offset >= len(scores):
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=scores.dtype)
+
+    if n >= len(scores):
+        order = np.lexsort((np.arange(len(scores)), -scores))
+    else:
+        # Partial selection: the n-th best score splits the vector into a small
+        # set of clear winners plus the recipes tied at the boundary
+        threshold = scores[np.argpartition(-scores, n - 1)[n - 1]]
+        above = np.flatnonzero(scores > threshold)
+        above = above[np.lexsort((above, -scores[above]))]
+        ties = np.flatnonzero(scores == threshold)[:n - len(above)]
+        order = np.concatenate([above, ties])
+
+    page = order[offset:n]
+    return page, scores[page]
+
+
+def score_candidates(input_vectors, postings):
+    # Accumulate query-term weights over the posting lists of the query terms only,
+    # so recipes sharing no term with the query are never touched. Each row of the
+    # result holds the candidate recipe ids and their cosine scores.
+    scores = input_vectors @ postings
+    scores.sort_indices()
+    return scores
+
+
+def score_segments(input_vectors, segments):
+    # Scores over several postings matrices whose recipe ids run on from one to the
+    # next (the base index, then the delta segment), as one row per query
+    segments = [postings for postings in segments if postings.shape[1]] or segments[:1]
+    scores = [score_candidates(input_vectors, postings) for postings in segments]
+    if len(scores) == 1:
+        return scores[0]
+    scores = hstack(scores, format='csr')
+    scores.sort_indices()
+    return scores
+
+
+def top_k_candidates(candidate_ids, candidate_scores, n_recipes, k, offset=0, allowed=None):
+    # Same ranking as top_k over the dense similarity vector, where every recipe
+    # that is not a candidate scores 0. candidate_ids must be sorted. allowed is an
+    # optional boolean mask over all recipes; recipes outside it are dropped before
+    # selection, so filtering costs no more than scoring.
+    keep = candidate_scores > 0
+    if allowed is not None:
+        keep &= allowed[candidate_ids]
+    candidate_ids, candidate_scores = candidate_ids[keep], candidate_scores[keep]
+
+    n = min(offset + k, n_recipes if allowed is None else int(np.count_nonzero(allowed)))
+    if n <= len(candidate_ids):
+        positions, scores = top_k(candidate_scores, k, offset)
+        return candidate_ids[positions], scores
+
+    # Not enough matches: rank all candidates and pad with the lowest-id recipes
+    # that scored 0, which is where the dense ranking would place them
+    positions, scores = top_k(candidate_scores, len(candidate_ids))
+    need = n - len(candidate_ids)
+    if allowed is None:
+        padding = np.arange(need + len(candidate_ids))
+    else:
+        padding = np.flatnonzero(allowed)[:need + len(candidate_ids)]
+    padding = np.setdiff1d(padding, candidate_ids, assume_unique=True)[:need]
+
+    ids = np.concatenate([candidate_ids[positions], padding])
+    scores = np.concatenate([scores, np.zeros(need, dtype=scores.dtype)])
+    return ids[offset:n], scores[offset:n]
+
+
+def top_k_batch(scores, n_recipes, k):
+    # Select the top k of each row of a block of queries scored with one
+    # sparse-by-sparse product
+    for row in range(scores.shape[0]):
+        start, end = scores.indptr[row], scores.indptr[row + 1]
+        yield top_k_candidates(scores.indices[start:end], scores.data[start:end], n_recipes, k)
+
+
+def top_k_dense(scores, k):
+    # top_k_batch for a dense block of scores, one row per query
+    for row in scores:
+        candidate_ids = np.flatnonzero(row > 0)
+        yield top_k_candidates(candidate_ids, row[candidate_ids], len(row), k)
@@ -0,0 +1,200 @@
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+
+import metrics
+import recipe_index
+import recommender
+
+# Scoring of queries in a pool of processes, so the sparse products run on every
+# core instead of holding up the request threads of one interpreter. The pool never
+# gets its own copy of the catalogue:
+#   - the base postings are memory-mapped from the index directory, the same page
+#     cache pages every worker already maps
+#   - the delta postings (and the whole index, when it was fitted in-process) are
+#     copied once into multiprocessing.shared_memory and attached by the processes
+# Queries that wait together are scored together, one row each of a single product.
+
+# Snapshots whose segments stay published; older ones are unlinked
+KEEP_GENERATIONS = 2
+
+# Segments attached in this pool process, keyed by their descriptor
+_attached = {}
+
+
+class SharedCSR:
+    # A CSR matrix copied into one shared memory block: data, then indptr, then
+    # indices, so every array starts on a multiple of its item size
+
+    def __init__(self, matrix):
+        arrays = [matrix.data, matrix.indptr, matrix.indices]
+        self.shm = SharedMemory(create=True, size=max(sum(array.nbytes for array in arrays), 1))
+        layout = []
+        offset = 0
+        for array in arrays:
+            np.ndarray(array.shape, array.dtype, buffer=self.shm.buf, offset=offset)[:] = array
+            layout.append((array.dtype.str, len(array), offset))
+            offset += array.nbytes
+        self.descriptor = ('shm', self.shm.name, matrix.shape, tuple(layout))
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def segment_descriptors(snapshot):
+    # How a pool process finds each postings segment of the snapshot, plus the
+    # shared memory blocks made for it
+    blocks = []
+    if snapshot.index.path is not None:
+        descriptors = [('file', snapshot.index.path)]
+    else:
+        blocks.append(SharedCSR(snapshot.index.postings))
+        descriptors = [blocks[-1].descriptor]
+    if snapshot.delta_postings.shape[1]:
+        blocks.append(SharedCSR(snapshot.delta_postings))
+        descriptors.append(blocks[-1].descriptor)
+    return tuple(descriptors), blocks
+
+
+def attach(descriptor):
+    # Runs in the pool processes
+    if descriptor[0] == 'file':
+        return None, recipe_index.load_postings(descriptor[1])
+
+    _, name, shape, layout = descriptor
+    # Spawned processes share their parent's resource tracker, so the block is
+    # unlinked once, by the ScoringPool that created it
+    shm = SharedMemory(name=name)
+    data, indptr, indices = [np.ndarray((length,), np.dtype(dtype), buffer=shm.buf, offset=offset)
+                             for dtype, length, offset in layout]
+    return shm, csr_matrix((data, indices, indptr), shape=shape, copy=False)
+
+
+def score_shared(descriptors, input_vectors):
+    # Runs in the pool processes: the same scores as Snapshot.score
+    for descriptor in list(_attached):
+        if descriptor not in descriptors:
+            shm, _ = _attached.pop(descriptor)
+            if shm is not None:
+                shm.close()
+    segments = []
+    for descriptor in descriptors:
+        if descriptor not in _attached:
+            _attached[descriptor] = attach(descriptor)
+        segments.append(_attached[descriptor][1])
+    return recommender.score_segments(input_vectors, segments)
+
+
+def ping():
+    return True
+
+
+class ScoringPool:
+    # Process pool scoring the query rows of a snapshot. Processes are spawned
+    # rather than forked, so they start clean even though the app runs threads.
+
+    def __init__(self, processes):
+        self.processes = processes
+        self.executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('spawn'))
+        self._generations = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Start the processes now rather than on the first query
+        for future in [self.executor.submit(ping) for _ in range(self.processes)]:
+            future.result()
+
+    def descriptors(self, snapshot):
+        with self._lock:
+            for published, descriptors, _ in self._generations:
+                if published is snapshot:
+                    return descriptors
+
+            descriptors, blocks = segment_descriptors(snapshot)
+            self._generations.append((snapshot, descriptors, blocks))
+            # Keep the previous snapshot's blocks for the queries still running on it
+            while len(self._generations) > KEEP_GENERATIONS:
+                for block in self._generations.pop(0)[2]:
+                    block.close()
+            return descriptors
+
+    def score(self, snapshot, input_vectors):
+        # A Future of snapshot.score(input_vectors)
+        return self.executor.submit(score_shared, self.descriptors(snapshot), input_vectors)
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+        with self._lock:
+            for _, _, blocks in self._generations:
+                for block in blocks:
+                    block.close()
+            self._generations = []
+
+
+class MicroBatcher:
+    # Collects single queries from the request threads and hands them to score,
+    # a callable(snapshot, input_vectors) returning a Future of the scores, as one
+    # stacked matrix. While max_in_flight batches are running, new queries queue up
+    # and go out together as the next batch, so a lone query is sent at once and
+    # batches only form under load.
+
+    def __init__(self, score, max_in_flight, max_batch=64):
+        self.score = score
+        self.max_in_flight = max_in_flight
+        self.max_batch = max_batch
+        self._pending = []
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._batch_sizes = metrics.registry.histogram(
+            'recipe_bowl_scoring_batch_size', 'Queries scored together in one batch',
+            buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+        threading.Thread(target=self._run, name='scoring-batcher', daemon=True).start()
+
+    def submit(self, snapshot, input_vector):
+        # A Future of the (candidate ids, scores) of the single query row
+        future = Future()
+        with self._cond:
+            self._pending.append((snapshot, input_vector, future))
+            self._cond.notify_all()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending or self._in_flight >= self.max_in_flight:
+                    self._cond.wait()
+                # Only queries on the same snapshot can share a product
+                snapshot = self._pending[0][0]
+                batch = [item for item in self._pending if item[0] is snapshot][:self.max_batch]
+                taken = {id(item) for item in batch}
+                self._pending = [item for item in self._pending if id(item) not in taken]
+                self._in_flight += 1
+            self._dispatch(snapshot, batch)
+
+    def _dispatch(self, snapshot, batch):
+        self._batch_sizes.observe(len(batch))
+        try:
+            future = self.score(snapshot, vstack([input_vector for _, input_vector, _ in batch], format='csr'))
+        except Exception as e:
+            future = Future()
+            future.set_exception(e)
+        future.add_done_callback(lambda future: self._finish(batch, future))
+
+    def _finish(self, batch, future):
+        try:
+            scores = future.result()
+        except Exception as e:
+            for _, _, item in batch:
+                item.set_exception(e)
+        else:
+            for row, (_, _, item) in enumerate(batch):
+                start, end = scores.indptr[row], scores.indptr[row + 1]
+                item.set_result((scores.indices[start:end], scores.data[start:end]))
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
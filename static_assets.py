@@ -0,0 +1,114 @@
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import time
+
+DEFAULT_STATIC_DIR = 'static'
+DEFAULT_BUILD_DIR = os.path.join('static', 'dist')
+MANIFEST_FILE = 'manifest.json'
+
+# Precompressed variants, best first, as (Content-Encoding, file suffix)
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+# A variant is only kept when it saves at least this fraction of the original
+MIN_SAVING = 0.1
+
+# Formats that are compressed already; they are not even tried
+COMPRESSED_EXTENSIONS = {'.avif', '.gif', '.gz', '.jpeg', '.jpg', '.mp3', '.png', '.webp', '.woff2'}
+
+
+def _brotli():
+    # brotli is optional; without it only gzip variants are built
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def compress(encoding, data):
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    brotli = _brotli()
+    return brotli.compress(data, quality=11) if brotli is not None else None
+
+
+def hashed_name(path, data):
+    # images/background.jpg -> images/background.<first 12 hex of sha256>.jpg
+    stem, ext = os.path.splitext(path)
+    return '%s.%s%s' % (stem, hashlib.sha256(data).hexdigest()[:12], ext)
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+
+def build(static_dir=DEFAULT_STATIC_DIR, build_dir=DEFAULT_BUILD_DIR):
+    # Copy every static file to build_dir under a content-hashed name, next to its
+    # precompressed variants, and write manifest.json mapping the original paths
+    # (relative to static_dir) to the hashed ones. Hashed files from earlier builds
+    # are left alone: pages cached before a deploy still point at them.
+    build_dir = os.path.abspath(build_dir)
+    manifest = {}
+    for root, dirs, names in os.walk(static_dir):
+        dirs[:] = [name for name in dirs if os.path.abspath(os.path.join(root, name)) != build_dir]
+        for name in sorted(names):
+            source = os.path.join(root, name)
+            path = os.path.relpath(source, static_dir).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+
+            target = hashed_name(path, data)
+            manifest[path] = target
+            target_path = os.path.join(build_dir, target)
+            if os.path.exists(target_path):
+                continue
+            if os.path.splitext(path)[1].lower() not in COMPRESSED_EXTENSIONS:
+                for encoding, suffix in ENCODINGS:
+                    compressed = compress(encoding, data)
+                    if compressed is not None and len(compressed) <= len(data) * (1 - MIN_SAVING):
+                        _write(target_path + suffix, compressed)
+            # The plain file goes last, so a complete one means its variants are done
+            _write(target_path, data)
+
+    _write(os.path.join(build_dir, MANIFEST_FILE), json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def load_manifest(build_dir=DEFAULT_BUILD_DIR):
+    # {} when no build was made; pages then link the unhashed files
+    try:
+        with open(os.path.join(build_dir, MANIFEST_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def choose_variant(build_dir, filename, accept_encodings):
+    # (file name, Content-Encoding or None) of the smallest variant the client accepts
+    for encoding, suffix in ENCODINGS:
+        if accept_encodings[encoding] and os.path.isfile(os.path.join(build_dir, filename + suffix)):
+            return filename + suffix, encoding
+    return filename, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build content-hashed, precompressed static assets.')
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--static-dir', default=DEFAULT_STATIC_DIR)
+    parser.add_argument('--build-dir', default=DEFAULT_BUILD_DIR)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        start = time.time()
+        manifest = build(args.static_dir, args.build_dir)
+        print('Built %d assets into %s in %.2fs' % (len(manifest), args.build_dir, time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import re
+from bisect import bisect_left
+
+import numpy as np
+
+import recommender
+
+WORD_PATTERN = re.compile(r'\w+')
+
+# Typos are corrected up to this many edits; short words allow fewer
+MAX_EDIT_DISTANCE = 2
+SHORT_WORD_LENGTH = 4
+
+# Exact distance checks per lookup, on top of the matches found without one. Only
+# reached in crowded neighbourhoods, where it can cost the tail of the list.
+MAX_DISTANCE_CHECKS = 48
+
+
+def edit_distance(a, b, max_distance):
+    # Optimal string alignment distance (insert, delete, substitute, swap neighbours),
+    # or max_distance + 1 as soon as it is clear the words are further apart
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    # A typo mostly leaves the start and the end of a word alone, and the shared
+    # prefix and suffix don't change the distance, so only the middle is aligned
+    n, m = len(a), len(b)
+    start = 0
+    while start < n and start < m and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < n - start and end < m - start and a[n - 1 - end] == b[m - 1 - end]:
+        end += 1
+    a, b = a[start:n - end], b[start:m - end]
+    n, m = n - start - end, m - start - end
+    if not n or not m:
+        return n + m
+    if n == m and (n <= 2 or a[1:-1] == b[1:-1]):
+        # Only the first and last letters differ: one substitution, or a swap of
+        # neighbours ("ab" -> "ba"), else two substitutions
+        return 1 if n == 1 or (n == 2 and a[0] == b[1] and a[1] == b[0]) else min(2, max_distance + 1)
+
+    # Only cells within max_distance of the diagonal can stay within max_distance;
+    # the others keep the value max_distance + 1. The min() of each cell is written
+    # out, as this loop is most of the cost of a lookup.
+    over = max_distance + 1
+    before, previous = None, list(range(m + 1))
+    for i in range(1, n + 1):
+        char, last = a[i - 1], a[i - 2] if i > 1 else None
+        current = [i] + [over] * m
+        low = i - max_distance if i > max_distance else 1
+        high = i + max_distance if i + max_distance < m else m
+        best = i if low == 1 else over
+        for j in range(low, high + 1):
+            value = previous[j - 1] + (char != b[j - 1])
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if last == b[j - 1] and j > 1 and char == b[j - 2] and before[j - 2] + 1 < value:
+                value = before[j - 2] + 1
+            current[j] = value
+            if value < best:
+                best = value
+        if best > max_distance:
+            return over
+        before, previous = previous, current
+    return min(previous[m], over)
+
+
+def deletes(word, distance):
+    # Every string reachable from word by removing up to distance characters
+    variants = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        variants |= frontier
+    return variants
+
+
+def max_distance_for(word):
+    return 1 if len(word) <= SHORT_WORD_LENGTH else MAX_EDIT_DISTANCE
+
+
+class IngredientSuggester:
+    # Autocomplete over the TF-IDF vocabulary. Completions come from a sorted term
+    # array: every term starting with a prefix sits in one contiguous slice found
+    # with two bisections, ranked by how many recipes use the term. Typos fall back
+    # to a symmetric-delete index (term deletes -> terms), so a misspelling only
+    # costs dictionary lookups plus at most MAX_DISTANCE_CHECKS exact distance checks.
+
+    def __init__(self, terms, frequencies, version=None):
+        self.version = version
+        order = np.argsort(terms, kind='stable')
+        self.terms = [terms[i] for i in order]
+        self.frequencies = np.asarray(frequencies)[order]
+
+        self.deletes = {}
+        for term_id, term in enumerate(self.terms):
+            for variant in deletes(term, max_distance_for(term)):
+                self.deletes.setdefault(variant, []).append(term_id)
+
+    @classmethod
+    def from_index(cls, index):
+        # Document frequency of each term is the length of its posting list
+        terms = [None] * len(index.vectorizer.vocabulary_)
+        for term, column in index.vectorizer.vocabulary_.items():
+            terms[column] = term
+        return cls(terms, np.diff(index.postings.indptr), version=index.version)
+
+    def complete(self, prefix, limit):
+        start = bisect_left(self.terms, prefix)
+        end = bisect_left(self.terms, prefix + '\U0010ffff', start)
+        positions, _ = recommender.top_k(self.frequencies[start:end], limit)
+        return [start + int(position) for position in positions]
+
+    def correct(self, word, limit):
+        # Rounds by the number of letters removed from word. A term first reached
+        # with k letters removed is at least k edits away, so once the terms closer
+        # than k fill the limit, nothing later can make the list. In the last round a
+        # new term is either exactly max_distance away or too far, so the new terms
+        # are checked most used first, only until the list is full.
+        max_distance = max_distance_for(word)
+        variants = deletes(word, max_distance)
+        distances = {}
+        checks = 0
+        for removed in range(max_distance + 1):
+            closer = sum(distance < removed for distance in distances.values())
+            if closer >= limit:
+                break
+            length = len(word) - removed
+            new = {term_id for variant in variants if len(variant) == length
+                   for term_id in self.deletes.get(variant, ()) if term_id not in distances}
+            if removed == max_distance:
+                new = sorted(new, key=lambda term_id: (-self.frequencies[term_id], self.terms[term_id]))
+            found = 0
+            for term_id in new:
+                term = self.terms[term_id]
+                if not removed or length == len(term):
+                    # One word is the other with letters removed: the distance is how many
+                    distance = abs(len(term) - len(word))
+                elif checks < MAX_DISTANCE_CHECKS:
+                    checks += 1
+                    distance = edit_distance(word, term, max_distance)
+                else:
+                    continue
+                distances[term_id] = distance
+                if removed == max_distance and distance <= max_distance:
+                    found += 1
+                    if closer + found >= limit:
+                        break
+
+        matches = [(distance, -int(self.frequencies[term_id]), self.terms[term_id], term_id)
+                   for term_id, distance in distances.items() if distance <= max_distance]
+        return [term_id for *_, term_id in sorted(matches)[:limit]]
+
+    def suggest(self, query, limit=10):
+        # Suggestions for the last word of the last comma separated ingredient in query;
+        # earlier words are kept as typed, so "onion, green chi" completes to "green chilli"
+        query = query.rsplit(',', 1)[-1]
+        words = WORD_PATTERN.findall(query.lower())
+        if not words or query[-1].isspace():
+            return []
+        head, word = ' '.join(words[:-1]), words[-1]
+
+        match = 'prefix'
+        term_ids = self.complete(word, limit)
+        if not term_ids:
+            match = 'typo'
+            term_ids = self.correct(word, limit)
+
+        return [{'ingredient': (head + ' ' + self.terms[term_id]).lstrip(),
+                 'recipes': int(self.frequencies[term_id]),
+                 'match': match} for term_id in term_ids]
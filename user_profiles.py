@@ -0,0 +1,121 @@
+from datetime import datetime
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# Likes lose half their weight in a profile after this many seconds
+DEFAULT_HALF_LIFE = 30 * 24 * 3600
+
+# Terms kept in a stored profile; the long tail of a heavy liker's history is dropped
+MAX_STORED_TERMS = 256
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def seconds(moment):
+    # Naive UTC datetimes, as stored in LikedRecipe.created_at, to seconds
+    return (moment - EPOCH).total_seconds()
+
+
+class Profile:
+    # A user's taste: the TF-IDF rows of the recipes they liked, each decayed by
+    # its age, summed into one sparse 1 x n_terms vector. vector holds the sum as
+    # of updated_at, so a new like only scales it and adds one recipe row, which is
+    # O(nnz) and never replays the history. Term ids belong to the vocabulary of
+    # the index version the profile was built against.
+    __slots__ = ('vector', 'updated_at', 'version')
+
+    def __init__(self, vector, updated_at, version):
+        self.vector = vector
+        self.updated_at = updated_at
+        self.version = version
+
+    @classmethod
+    def empty(cls, n_terms, version):
+        return cls(csr_matrix((1, n_terms), dtype=np.float32), 0.0, version)
+
+    @classmethod
+    def from_record(cls, record, n_terms):
+        # record: a UserProfile row
+        terms = np.frombuffer(record.terms, dtype=np.int32)
+        weights = np.frombuffer(record.weights, dtype=np.float32)
+        vector = csr_matrix((weights, terms, [0, len(terms)]), shape=(1, n_terms))
+        return cls(vector, seconds(record.updated_at), record.index_version)
+
+    def to_record(self):
+        return {
+            'index_version': self.version,
+            'terms': self.vector.indices.astype(np.int32).tobytes(),
+            'weights': self.vector.data.astype(np.float32).tobytes(),
+            'updated_at': datetime.utcfromtimestamp(self.updated_at),
+        }
+
+    def add(self, terms, weights, liked_at, half_life=DEFAULT_HALF_LIFE):
+        # Fold in one liked recipe's TF-IDF row (terms, weights), liked at liked_at seconds
+        row = csr_matrix((np.asarray(weights, dtype=np.float32), terms, [0, len(terms)]), shape=self.vector.shape)
+        if liked_at >= self.updated_at:
+            self.vector = self.vector * np.float32(0.5 ** ((liked_at - self.updated_at) / half_life)) + row
+            self.updated_at = liked_at
+        else:
+            # A like older than the profile, e.g. written late by the like buffer
+            self.vector = self.vector + row * np.float32(0.5 ** ((self.updated_at - liked_at) / half_life))
+        self._prune()
+
+    def _prune(self):
+        vector = self.vector.tocsr()
+        vector.sum_duplicates()
+        vector.eliminate_zeros()
+        if vector.nnz > MAX_STORED_TERMS:
+            keep = np.sort(np.argpartition(-vector.data, MAX_STORED_TERMS - 1)[:MAX_STORED_TERMS])
+            vector = csr_matrix((vector.data[keep], vector.indices[keep], [0, MAX_STORED_TERMS]),
+                                shape=vector.shape)
+        self.vector = vector
+
+    def query_vector(self, max_terms):
+        # The profile's strongest terms as a unit-length row, or None when it is empty
+        vector = self.vector
+        if not vector.nnz:
+            return None
+        data, indices = vector.data, vector.indices
+        if len(data) > max_terms:
+            keep = np.sort(np.argpartition(-data, max_terms - 1)[:max_terms])
+            data, indices = data[keep], indices[keep]
+        data = data / np.linalg.norm(data)
+        return csr_matrix((data.astype(np.float64), indices, [0, len(indices)]), shape=vector.shape)
+
+
+def build(snapshot, liked, half_life=DEFAULT_HALF_LIFE):
+    # Profile from scratch out of (recipe_id, liked_at datetime) pairs, summed in
+    # one go. Only needed for a user without a stored profile or after the
+    # vocabulary was refitted.
+    profile = Profile.empty(snapshot.index.matrix.shape[1], snapshot.index.version)
+    liked = [(recipe_id, seconds(liked_at)) for recipe_id, liked_at in liked if 0 <= recipe_id < len(snapshot)]
+    if not liked:
+        return profile
+
+    profile.updated_at = max(liked_at for _, liked_at in liked)
+    terms, weights = [], []
+    for recipe_id, liked_at in liked:
+        row_terms, row_weights = snapshot.recipe_terms(recipe_id)
+        terms.append(row_terms)
+        weights.append(np.asarray(row_weights, dtype=np.float32)
+                       * np.float32(0.5 ** ((profile.updated_at - liked_at) / half_life)))
+    terms, weights = np.concatenate(terms), np.concatenate(weights)
+    profile.vector = csr_matrix((weights, terms, [0, len(terms)]), shape=profile.vector.shape)
+    profile._prune()
+    return profile
+
+
+def blend(input_vector, profile, weight, max_terms=10):
+    # Move the query toward the user's taste: q + weight * p, back to unit length.
+    # Only the profile's max_terms strongest terms take part, so a long history
+    # can't widen the set of candidate recipes much.
+    profile_vector = profile.query_vector(max_terms)
+    if profile_vector is None or weight <= 0:
+        return input_vector
+    blended = (input_vector + profile_vector * weight).tocsr()
+    norm = np.sqrt((blended.data ** 2).sum())
+    if norm:
+        blended.data /= norm
+    blended.sort_indices()
+    return blended